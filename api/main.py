@@ -8,24 +8,84 @@
 # © 2024
 # -----------------------------------------------------------------------------
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Query
 from fastapi.responses import JSONResponse
 from loguru import logger
-from models import OverseerrWebhook
+from models import OverseerrWebhook, MediaType
 from utils import (
-    start_processing_queue, get_imdb_id_from_trakt, query_torrentio,
-    check_rd_availability, add_torrent_and_select_files
+    sync_overseerr_requests, start_workers, enqueue_request, pipeline_key, request_queue, worker_supervisor,
+    RD_INSTANT_AVAILABILITY_URL
+)
+from supervisor import WORKER_SHUTDOWN_TIMEOUT
+from scheduler import SyncScheduler, SYNC_INTERVAL_MINUTES
+from jobs import job_store, PipelineResult
+from singleflight import pipeline_flight
+import ledger
+import backoff
+from ratelimiter import governors
+from concurrency import worker_limiter
+from ranking import ranking_service
+from candidates import (
+    collect_info_hashes, rank_streams_async, rank_table_async, RankedCandidate, StreamingSelection,
+    RANK_FIRST, RANK_FIRST_TOP_N, SELECT_STREAMING
+)
+from async_client import (
+    resolve_imdb_id, query_torrentio, check_rd_availability_bulk,
+    add_torrent_and_select_files, close_client
 )
 from pydantic import ValidationError
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 from RTN import RTN
 from RTN.models import SettingsModel, CustomRank, DefaultRanking
-from RTN.exceptions import GarbageTorrent
-from settings import rtn, settings
 import os
+import asyncio
+from contextlib import asynccontextmanager
+
+# Polls Overseerr in the background and feeds the worker queue
+scheduler = SyncScheduler(sync_overseerr_requests, SYNC_INTERVAL_MINUTES * 60)
+
+# Start background work with the server and release it on shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WEBHOOK_MODE == "queue":
+        start_workers()
+    confirmation = os.getenv("STARTUP_CONFIRMATION", "n").lower()
+    if confirmation == 'y':
+        scheduler.start()
+    else:
+        logger.warning("Startup event skipped by user.")
+    yield
+    # Uvicorn runs this on SIGTERM: stop feeding the queue, then let running jobs finish
+    scheduler.stop()
+    await asyncio.to_thread(worker_supervisor.drain, WORKER_SHUTDOWN_TIMEOUT)
+    ranking_service.shutdown()
+    await close_client()
 
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+# "inline" runs the pipeline inside the webhook call, "queue" accepts the
+# payload, hands it to the worker queue and returns a job id immediately
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "inline").lower()
+
+# Build an Overseerr-request-shaped dict from a webhook payload for the workers
+def webhook_to_request(req: OverseerrWebhook) -> Dict[str, Any]:
+    seasons = []
+    for item in req.extra:
+        if item.get("name") == "Requested Seasons":
+            seasons = [{"seasonNumber": int(number)} for number in str(item.get("value", "")).split(",") if number.strip().isdigit()]
+    # Webhook payloads don't say whether the request is for 4K, so they use the standard profile
+    return {
+        "id": None,
+        "is4k": False,
+        "seasons": seasons,
+        "media": {
+            "id": None,
+            "tmdbId": req.media.tmdbId,
+            "imdbId": req.media.imdbId,
+            "mediaType": req.media.media_type
+        }
+    }
 
 # FastAPI endpoint to receive the webhook payload from Jellyseer
 @app.post("/jellyseer-webhook/")
@@ -45,73 +105,194 @@ async def jellyseer_webhook(request: Request) -> Dict[str, Any]:
         logger.error(f"Failed to process request: {e}")
         return JSONResponse(content={"success": False, "message": str(e)}, status_code=400)
 
-    try:
-        # Step 1: Extract the tmdbId from the payload's media object
-        tmdb_id = req.media.tmdbId
-        media_type = req.media.media_type
-        logger.info(f"Received tmdbId: {tmdb_id} and media type: {media_type} from Jellyseerr webhook.")
-
-        # Step 3: Fetch IMDb ID using Trakt API
-        imdb_id = get_imdb_id_from_trakt(tmdb_id, media_type)
-        logger.info(f"Fetching IMDb ID using Trakt API for tmdbId: {tmdb_id}...")
-        if not imdb_id:
-            return JSONResponse(content={"success": False, "message": "IMDb ID not found"}, status_code=404)
-
-        logger.info(f"IMDb ID found: {imdb_id}")
-
-        # Step 4: Query Torrentio API to get torrents
-        logger.info(f"Querying Torrentio API for torrents with IMDb ID: {imdb_id}...")
-        torrentio_results = query_torrentio(imdb_id, media_type)
-        if not torrentio_results or not torrentio_results.get('streams'):
-            logger.error("No torrents found on Torrentio.")
-            return JSONResponse(content={"success": False, "message": "No torrents found"}, status_code=404)
-
-        # Step 5: Check Real-Debrid availability and rank torrents
-        logger.info("Checking Real-Debrid availability and ranking torrents...")
-
-        for stream in torrentio_results['streams']:
-            info_hash = stream.get('infoHash')
-            title = stream.get('title')
-            file_idx = stream.get('fileIdx')
-            
-            if info_hash and title and file_idx is not None:
-                rd_availability = check_rd_availability(info_hash)
-                
-                if rd_availability:
-                    try:
-                        # Rank the torrent using RTN
-                        torrent = rtn.rank(title, info_hash)
-                        if torrent.fetch:  # Check if the torrent is worth fetching
-                            logger.info(f"Best torrent selected: {torrent.data.parsed_title} with rank {torrent.rank}")
-                            # Add the best torrent to Real-Debrid
-                            result = add_torrent_and_select_files(torrent.infohash, torrent.data.parsed_title, file_idx, media_type)
-                            if result.get('success'):
-                                return JSONResponse(content={"success": True, "message": "Torrent added"}, status_code=200)
-                            else:
-                                logger.error("Failed to add torrent to Real-Debrid")
-                                return JSONResponse(content={"success": False, "message": "Failed to add torrent to Real-Debrid"}, status_code=500)
-                        else:
-                            logger.info(f"Torrent {title} does not meet the criteria and will be skipped.")
-                            continue
-                    except GarbageTorrent:
-                        logger.info(f"Torrent {title} is marked as garbage and will be skipped.")
-                        continue
+    if WEBHOOK_MODE == "queue":
+        job = enqueue_request(webhook_to_request(req), "webhook")
+        logger.info(f"Queued job {job.id} for tmdbId: {req.media.tmdbId}")
+        return JSONResponse(
+            content={"success": True, "job_id": job.id, "status_url": f"/jobs/{job.id}"},
+            status_code=202
+        )
 
-        logger.error("No torrents available on Real-Debrid.")
-        return JSONResponse(content={"success": False, "message": "No torrents available on Real-Debrid"}, status_code=404)
+    try:
+        key = pipeline_key(webhook_to_request(req))
+        processed = ledger.get_processed(key)
+        if processed:
+            logger.info(f"Skipping {key}: already processed with torrent {processed['info_hash']}")
+            return JSONResponse(content={"success": True, "message": "Already processed"}, status_code=200)
 
+        result, shared = await pipeline_flight.do_async(key, run_webhook_pipeline, req)
+        if shared:
+            logger.info(f"Shared the result of an in-flight pipeline run for {key}")
+        else:
+            ledger.record(key, "succeeded" if result.success else "failed",
+                          info_hash=result.info_hash, torrent_id=result.torrent_id, message=result.message)
+            backoff.update(key, result.success, result.reason, webhook_to_request(req))
     except Exception as e:
         logger.error(f"Error processing webhook payload: {e}")
-        return JSONResponse(content={"success": False, "message": str(e)}, status_code=500)
+        result = PipelineResult(False, str(e), 500)
+    return JSONResponse(content={"success": result.success, "message": result.message}, status_code=result.status_code)
 
-# Start processing the queue when the FastAPI server starts
-@app.on_event("startup")
-async def startup_event():
-    confirmation = os.getenv("STARTUP_CONFIRMATION", "n").lower()
-    if confirmation == 'y':
-        start_processing_queue()
+# Run the Trakt -> Torrentio -> RD pipeline for one webhook payload
+async def run_webhook_pipeline(req: OverseerrWebhook) -> PipelineResult:
+    # Step 1: Extract the tmdbId from the payload's media object
+    tmdb_id = req.media.tmdbId
+    media_type = req.media.media_type
+    logger.info(f"Received tmdbId: {tmdb_id} and media type: {media_type} from Jellyseerr webhook.")
+
+    # Step 3: Resolve the IMDb ID from the payload, the ID cache or Trakt
+    logger.info(f"Resolving IMDb ID for tmdbId: {tmdb_id}...")
+    imdb_id = await resolve_imdb_id(tmdb_id, media_type, req.media.imdbId)
+    if not imdb_id:
+        return PipelineResult(False, "IMDb ID not found", 404, reason="imdb_not_found")
+
+    logger.info(f"IMDb ID found: {imdb_id}")
+
+    # Step 4: Query Torrentio API to get torrents
+    logger.info(f"Querying Torrentio API for torrents with IMDb ID: {imdb_id}...")
+    torrentio_results = await query_torrentio(imdb_id, media_type)
+    if not torrentio_results or not torrentio_results.get('streams'):
+        logger.error("No torrents found on Torrentio.")
+        return PipelineResult(False, "No torrents found", 404, reason="no_torrents")
+
+    # Step 5: Check Real-Debrid availability and rank torrents
+    logger.info("Checking Real-Debrid availability and ranking torrents...")
+    if SELECT_STREAMING:
+        best = await select_streaming(torrentio_results['streams'])
+    elif RANK_FIRST:
+        best = await select_rank_first(torrentio_results['streams'])
     else:
-        logger.warning("Startup event skipped by user.")
+        best = await select_rd_first(torrentio_results['streams'])
+
+    if best is None:
+        logger.error("No torrents available on Real-Debrid.")
+        return PipelineResult(False, "No torrents available on Real-Debrid", 404, reason="no_candidates")
+
+    # Step 6: Add the best torrent to Real-Debrid
+    logger.info(f"Best torrent selected: {best.title} with rank {best.rank}")
+    result = await add_torrent_and_select_files(best.info_hash, best.title, best.file_idx, media_type)
+    if result and result.get('success'):
+        return PipelineResult(True, "Torrent added", info_hash=best.info_hash, torrent_id=result.get('torrent_id'))
+    else:
+        logger.error("Failed to add torrent to Real-Debrid")
+        return PipelineResult(False, "Failed to add torrent to Real-Debrid", 500)
+
+# Take the first stream, in Torrentio order, that is cached on RD and worth fetching
+async def select_rd_first(streams: List[Dict[str, Any]]) -> Optional[RankedCandidate]:
+    availability = await check_rd_availability_bulk(collect_info_hashes(streams))
+    available = [
+        stream for stream in streams
+        if stream.get('fileIdx') is not None and availability.get((stream.get('infoHash') or '').lower())
+    ]
+    candidates = await rank_streams_async(available, sort=False)
+    return candidates[0] if candidates else None
+
+# Rank every stream locally, then take the best of the top N that is cached on RD
+async def select_rank_first(streams: List[Dict[str, Any]]) -> Optional[RankedCandidate]:
+    ranked_candidates = (await rank_streams_async(streams))[:RANK_FIRST_TOP_N]
+    if not ranked_candidates:
+        return None
+    availability = await check_rd_availability_bulk([candidate.info_hash for candidate in ranked_candidates])
+    return next((candidate for candidate in ranked_candidates if availability.get(candidate.info_hash)), None)
+
+# Rank every stream locally, then check RD availability best first until one is cached
+async def select_streaming(streams: List[Dict[str, Any]]) -> Optional[RankedCandidate]:
+    base_url = RD_INSTANT_AVAILABILITY_URL.format(hash="").rstrip("/")
+    selection = StreamingSelection(*await rank_table_async(streams), base_url)
+    while not selection.done:
+        rows = selection.next_batch()
+        selection.offer(rows, await check_rd_availability_bulk([selection.table.info_hashes[row] for row in rows]))
+    candidates = selection.result()
+    return candidates[0] if candidates else None
+
+# Report the status and per-stage timing of a queued job
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str) -> Dict[str, Any]:
+    job = job_store.get(job_id)
+    if job is None:
+        return JSONResponse(content={"success": False, "message": "Job not found"}, status_code=404)
+    return job.model_dump()
+
+# Report when the Overseerr sync last ran and when it runs next
+@app.get("/scheduler")
+async def get_scheduler() -> Dict[str, Any]:
+    return scheduler.status()
+
+# Run the Overseerr sync now instead of waiting for the next interval
+@app.post("/scheduler/run")
+async def run_scheduler() -> Dict[str, Any]:
+    if not scheduler.status()["enabled"]:
+        return JSONResponse(content={"success": False, "message": "Scheduler is not running"}, status_code=409)
+    scheduler.trigger()
+    return JSONResponse(content={"success": True, "message": "Sync triggered"}, status_code=202)
+
+# Report request counts and waiting time of each upstream rate governor
+@app.get("/rate-limits")
+async def get_rate_limits() -> Dict[str, Any]:
+    return {name: governor.stats() for name, governor in governors.items()}
+
+# Report the adaptive worker concurrency limit and the signals driving it
+@app.get("/concurrency")
+async def get_concurrency() -> Dict[str, Any]:
+    stats = worker_limiter.stats()
+    stats["queued"] = request_queue.qsize()
+    return stats
+
+# Report the ranking pool and the hit rate of the rank cache
+@app.get("/ranking")
+async def get_ranking() -> Dict[str, Any]:
+    return {
+        "processes": ranking_service.processes,
+        "fingerprint": ranking_service.fingerprint,
+        "cache": ranking_service.cache.stats(),
+        "profiles": list(ranking_service.profiles),
+        "prefilter": {
+            profile: {"checked": prefilter.checked, "rejected": prefilter.rejected}
+            for profile, prefilter in ranking_service.prefilters.items()
+        }
+    }
+
+# Report what each queue worker is doing
+@app.get("/workers")
+async def get_workers() -> Dict[str, Any]:
+    status = worker_supervisor.status()
+    for worker in status["workers"]:
+        job = job_store.get(worker["job_id"]) if worker["job_id"] else None
+        worker["stage"] = job.stages[-1].name if job and job.stages else None
+    return status
+
+# Stop the workers from taking new jobs, running jobs are finished
+@app.post("/workers/pause")
+async def pause_workers() -> Dict[str, Any]:
+    worker_supervisor.pause()
+    return {"success": True, "message": "Workers paused"}
+
+# Let paused workers take jobs again
+@app.post("/workers/resume")
+async def resume_workers() -> Dict[str, Any]:
+    worker_supervisor.resume()
+    return {"success": True, "message": "Workers resumed"}
+
+# Clear one request (title, seasons, 4K) from the ledger and backoff and queue it again
+@app.post("/requests/{tmdb_id}/reprocess")
+async def reprocess_request(tmdb_id: int, media_type: MediaType = "movie", is4k: bool = False,
+                            seasons: Optional[List[int]] = Query(None)) -> Dict[str, Any]:
+    request = {
+        "id": None,
+        "is4k": is4k,
+        "seasons": [{"seasonNumber": season} for season in seasons or []],
+        "media": {"id": None, "tmdbId": tmdb_id, "imdbId": None, "mediaType": media_type}
+    }
+    # Only this version of the title is reset, other seasons and 4K keep their state
+    key = pipeline_key(request)
+    request["media"]["id"] = ledger.find_media_id(key)
+    ledger.forget(key)
+    backoff.clear_key(key)
+    start_workers()
+    job = enqueue_request(request, "retry", force=True)
+    return JSONResponse(
+        content={"success": True, "job_id": job.id, "status_url": f"/jobs/{job.id}"},
+        status_code=202
+    )
 
 # Main entry point for running the FastAPI server
 if __name__ == "__main__":
@@ -0,0 +1,376 @@
+import asyncio
+import mimetypes
+import time
+from typing import Optional, Any, Dict, Tuple
+
+import httpx
+from loguru import logger
+
+from cache import torrentio_cache, rd_availability_cache
+from candidates import chunk_hashes
+from id_cache import get_cached_imdb_id, store_imdb_id
+from singleflight import upstream_flight
+from ratelimiter import governor_for_url, parse_retry_after
+from concurrency import worker_limiter
+from utils import (
+    REAL_DEBRID_API_BASE_URL, RD_ADD_TORRENT_URL, RD_INSTANT_AVAILABILITY_URL,
+    MAX_RETRIES, BACKOFF_FACTOR, RETRY_STATUS_CODES, RETRY_METHODS,
+    RD_API_KEY, TRAKT_API_KEY,
+    torrentio_request
+)
+
+# Connection pool settings for the shared async client
+MAX_CONNECTIONS = 20
+MAX_KEEPALIVE_CONNECTIONS = 10
+REQUEST_TIMEOUT = 10
+
+# Strong references to fire-and-forget background tasks (cache revalidation)
+_background_tasks = set()
+
+# Shared keep-alive connection pool, created lazily on the running event loop
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            headers={
+                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"
+            },
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS
+            ),
+            timeout=REQUEST_TIMEOUT
+        )
+    return _client
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+async def request(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Send a request through the shared client. Like the sync session, every
+    attempt passes through the host's rate governor, 5xx responses to
+    idempotent requests are retried with exponential backoff and a 429
+    pauses the host for its Retry-After.
+    """
+    client = get_client()
+    governor = governor_for_url(url)
+    for attempt in range(MAX_RETRIES + 1):
+        await governor.acquire_async()
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        worker_limiter.record(governor.name, time.perf_counter() - start, response.status_code)
+        if response.status_code == 429:
+            governor.penalize(parse_retry_after(response.headers.get('Retry-After')))
+        elif response.status_code not in RETRY_STATUS_CODES or method.upper() not in RETRY_METHODS:
+            return response
+        if attempt == MAX_RETRIES:
+            return response
+        if response.status_code != 429:
+            await asyncio.sleep(BACKOFF_FACTOR * (2 ** attempt))
+    return response
+
+
+# Resolve the IMDb ID, preferring the payload and the local cache over Trakt
+async def resolve_imdb_id(tmdb_id: int, media_type: str, imdb_id: Optional[str] = None) -> Optional[str]:
+    """
+    Resolve the IMDb ID for a TMDb ID in three tiers: the ID carried by the
+    request payload, the persistent ID cache, then the Trakt API.
+    """
+    if imdb_id:
+        return imdb_id
+
+    hit, imdb_id = get_cached_imdb_id(tmdb_id, media_type)
+    if hit:
+        logger.info(f"IMDb ID for tmdbId {tmdb_id} served from cache: {imdb_id}")
+        return imdb_id
+
+    definitive, imdb_id = await lookup_imdb_id_on_trakt(tmdb_id, media_type)
+    if definitive:
+        store_imdb_id(tmdb_id, media_type, imdb_id)
+    return imdb_id
+
+
+# Fetch the IMDb ID using the Trakt API based on the TMDb ID
+async def get_imdb_id_from_trakt(tmdb_id: int, media_type: str) -> Optional[str]:
+    """
+    Fetch the IMDb ID using the Trakt API based on the TMDb ID.
+    """
+    return (await lookup_imdb_id_on_trakt(tmdb_id, media_type))[1]
+
+
+async def lookup_imdb_id_on_trakt(tmdb_id: int, media_type: str) -> Tuple[bool, Optional[str]]:
+    """
+    Search Trakt for the IMDb ID. Returns (definitive, imdb_id), where
+    definitive is False when the lookup failed and the answer is unknown.
+    """
+    if media_type == "tv":
+        url = f"https://api.trakt.tv/search/tmdb/{tmdb_id}?type=show"
+    else:
+        url = f"https://api.trakt.tv/search/tmdb/{tmdb_id}?type=movie"
+
+    headers = {
+        "Content-type": "application/json",
+        "trakt-api-key": TRAKT_API_KEY,
+        "trakt-api-version": "2"
+    }
+
+    for attempt in range(5):  # Retry up to 5 times
+        try:
+            response = await request("GET", url, headers=headers)
+
+            if response.status_code == 200:
+                data = response.json()
+                if data and isinstance(data, list):
+                    if media_type == "tv":
+                        return True, data[0]['show']['ids']['imdb']
+                    else:
+                        return True, data[0]['movie']['ids']['imdb']
+                else:
+                    logger.error("IMDb ID not found in Trakt API response.")
+                    return True, None
+            else:
+                logger.error(f"Trakt API request failed with status code {response.status_code}")
+                return False, None
+        except httpx.HTTPError as e:
+            logger.error(f"Error fetching IMDb ID from Trakt API (attempt {attempt + 1}): {e}")
+            if attempt == 4:  # Last attempt
+                return False, None
+
+
+# Query Torrentio API to get available torrents
+async def query_torrentio(imdb_id: str, media_type: str, season: int = 1, episode: int = 1) -> Optional[Dict[str, Any]]:
+    """
+    Return the Torrentio stream listing, served from the shared response cache
+    while fresh. Stale entries are returned immediately and revalidated in a
+    background task.
+    """
+    key, url = torrentio_request(imdb_id, media_type, season, episode)
+    entry, needs_refresh = torrentio_cache.lookup(key)
+    if entry is not None:
+        if needs_refresh and torrentio_cache.claim_refresh(key):
+            task = asyncio.create_task(_revalidate_torrentio(key, url))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+        logger.info(f"Torrentio results for {imdb_id} served from cache (age {entry.age:.0f}s)")
+        return entry.data
+    return (await upstream_flight.do_async(("torrentio", url), fetch_torrentio, key, url))[0]
+
+
+async def _revalidate_torrentio(key: tuple, url: str) -> None:
+    try:
+        await upstream_flight.do_async(("torrentio", url), fetch_torrentio, key, url)
+    finally:
+        torrentio_cache.release_refresh(key)
+
+
+async def fetch_torrentio(key: tuple, url: str) -> Optional[Dict[str, Any]]:
+    """
+    Fetch a Torrentio listing and store it in the cache, revalidating with
+    ETag/Last-Modified when a previous response is known.
+    """
+    previous = torrentio_cache.get(key)
+    headers = previous.validators() if previous else {}
+
+    for attempt in range(5):  # Retry up to 5 times
+        try:
+            response = await request("GET", url, headers=headers)
+            if response.status_code == 304 and previous:
+                torrentio_cache.touch(key, previous)
+                return previous.data
+            elif response.status_code == 200:
+                data = response.json()
+                torrentio_cache.store(key, data, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+                return data
+            else:
+                logger.error(f"Torrentio API failed with status code {response.status_code}")
+                return None
+        except httpx.HTTPError as e:
+            logger.error(f"Error querying Torrentio API (attempt {attempt + 1}): {e}")
+            if attempt == 4:  # Last attempt
+                return None
+
+
+# Check torrent availability on Real-Debrid
+async def get_instant_availability(hashes: list[str]) -> dict[str, dict[int, dict[str, int]]]:
+    """
+    Get the instant availability of hash(es). Normalizes the output into a dict,
+    see utils.get_instant_availability for the shape.
+    """
+    results = await fetch_instant_availability(hashes)
+    if results is None:
+        return {hash: {} for hash in hashes}
+    return results
+
+
+async def fetch_instant_availability(hashes: list[str]) -> Optional[dict[str, dict[int, dict[str, int]]]]:
+    """
+    Query instantAvailability for hash(es). Returns None when the request
+    failed, so callers can tell "not cached" from "unknown".
+    """
+    hashes_str = "/".join(hashes)
+    url = RD_INSTANT_AVAILABILITY_URL.format(hash=hashes_str)
+    headers = {
+        'Authorization': f'Bearer {RD_API_KEY}'
+    }
+    response = await request("GET", url, headers=headers)
+
+    if response.status_code != 200:
+        logger.error(f"Real-Debrid instant availability failed with status code {response.status_code}")
+        return None
+
+    data = response.json()
+
+    # Ensure the response is a dictionary and not a list
+    if isinstance(data, list):
+        logger.error("Unexpected response format: received a list instead of a dictionary.")
+        return None
+
+    results = {}
+    for hash, values in data.items():
+        if isinstance(values, dict) and "rd" in values and values["rd"]:
+            result = {int(k): {"filename": v["filename"], "filesize": v["filesize"]}
+                      for container in values["rd"] for k, v in container.items()}
+            results[hash.lower()] = result
+        else:
+            results[hash.lower()] = {}
+    return results
+
+
+async def check_rd_availability(info_hash: str) -> Optional[Dict[str, Any]]:
+    """
+    Check the instant availability of a torrent hash on Real-Debrid.
+    """
+    info_hash = info_hash.lower()
+    files = (await check_rd_availability_bulk([info_hash]))[info_hash]
+    if files:
+        logger.info(f"Torrent with hash {info_hash} is available on Real-Debrid.")
+        return files
+    logger.info(f"Torrent with hash {info_hash} is not available on Real-Debrid.")
+    return None
+
+
+async def check_rd_availability_bulk(info_hashes: list[str]) -> dict[str, dict[int, dict[str, int]]]:
+    """
+    Resolve the instant availability of many hashes. Hashes found in the
+    shared availability cache are not sent to RD; the rest go out in
+    URL-length-bounded batches, issued concurrently. Keys are lowercase
+    hashes, non-cached hashes map to an empty dict.
+    """
+    results, misses = rd_availability_cache.get_many([info_hash.lower() for info_hash in info_hashes])
+    num_hits = len(results)
+    base_url = RD_INSTANT_AVAILABILITY_URL.format(hash="").rstrip("/")
+    chunks = list(chunk_hashes(misses, base_url))
+    responses = await asyncio.gather(*(
+        upstream_flight.do_async(("rd_availability", tuple(chunk)), fetch_instant_availability, chunk)
+        for chunk in chunks
+    ))
+
+    for chunk, (availability, _) in zip(chunks, responses):
+        chunk_results = {info_hash: (availability or {}).get(info_hash) or {} for info_hash in chunk}
+        if availability is not None:
+            rd_availability_cache.put_many(chunk_results)
+        results.update(chunk_results)
+    cached = sum(1 for files in results.values() if files)
+    logger.info(f"{cached}/{len(results)} torrents available on Real-Debrid ({num_hits} from cache, {len(chunks)} requests)")
+    return results
+
+
+# Add torrent to Real-Debrid and select specific files
+async def add_torrent_and_select_files(info_hash: str, torrent_name: str, file_idx: int, media_type: str) -> Optional[Dict[str, Any]]:
+    """
+    Add a torrent to Real-Debrid and select specific files.
+
+    :param info_hash: The info hash of the torrent.
+    :param torrent_name: The name of the torrent.
+    :param file_idx: The index of the file to select (0-based index).
+    :param media_type: The type of media (movie or tv).
+    :return: The response from the Real-Debrid API if successful, None otherwise.
+    """
+    headers = {
+        'Authorization': f'Bearer {RD_API_KEY}'
+    }
+    data = {
+        'magnet': f"magnet:?xt=urn:btih:{info_hash}&dn={torrent_name}"
+    }
+    response = await request("POST", RD_ADD_TORRENT_URL, headers=headers, data=data)
+
+    if response.status_code == 201:
+        rd_response = response.json()
+        torrent_id = rd_response.get('id')
+
+        if torrent_id:
+            logger.info(f"Torrent added to Real-Debrid successfully: {info_hash}")
+
+            if await select_files_in_rd(torrent_id, file_idx, media_type):
+                return {"success": True, "message": "Torrent added and files selected.", "torrent_id": torrent_id}
+            else:
+                return {"success": False, "message": "Failed to select files in the torrent."}
+        else:
+            logger.error("Torrent ID not found in Real-Debrid response.")
+            return {"success": False, "message": "Torrent added, but torrent ID not found."}
+    else:
+        logger.error(f"Failed to add torrent to Real-Debrid with status code {response.status_code}")
+        return None
+
+
+# Select specific files from the torrent in Real-Debrid
+async def select_files_in_rd(torrent_id: str, file_idx: int, media_type: str) -> bool:
+    """
+    Select specific files in a Real-Debrid torrent using the torrent ID.
+
+    :param torrent_id: The ID of the torrent in Real-Debrid.
+    :param file_idx: The index of the file to be selected (0-based index).
+    :param media_type: The type of media (movie or tv).
+    :return: True if the files were successfully selected, False otherwise.
+    """
+    url = f"{REAL_DEBRID_API_BASE_URL}/torrents/selectFiles/{torrent_id}"
+    headers = {
+        'Authorization': f'Bearer {RD_API_KEY}'
+    }
+
+    # Fetch the list of files in the torrent
+    files_url = f"{REAL_DEBRID_API_BASE_URL}/torrents/info/{torrent_id}"
+    files_response = await request("GET", files_url, headers=headers)
+
+    if files_response.status_code != 200:
+        logger.error(f"Failed to fetch files for torrent ID: {torrent_id}. Status code: {files_response.status_code}")
+        return False
+
+    files = files_response.json().get('files', [])
+
+    # Ensure the file index is within the range of available files
+    if file_idx < 0 or file_idx >= len(files):
+        logger.error(f"File index {file_idx} is out of range for torrent ID: {torrent_id}")
+        return False
+
+    if media_type == "movie":
+        # For movies, select the specific file based on file_idx
+        data = {'files': str(files[file_idx]['id'])}
+    elif media_type == "tv":
+        # For TV shows, select all playable files
+        playable_files = [str(file['id']) for file in files if (mimetypes.guess_type(file.get('path', ''))[0] or '').startswith('video')]
+        if not playable_files:
+            logger.error(f"No playable files found in torrent ID: {torrent_id}")
+            return False
+        data = {'files': ",".join(playable_files)}
+    else:
+        logger.error(f"Unknown media type: {media_type}")
+        return False
+
+    response = await request("POST", url, headers=headers, data=data)
+
+    if response.status_code == 204:
+        logger.info(f"Files successfully selected for torrent ID: {torrent_id}")
+        return True
+    else:
+        logger.error(f"Failed to select files for torrent ID: {torrent_id}. Status code: {response.status_code}")
+        return False
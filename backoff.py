@@ -0,0 +1,136 @@
+import json
+import os
+import random
+import sqlite3
+import time
+from typing import Optional, Dict, Any, Tuple, List
+
+from loguru import logger
+
+from db import register_schema, get_connection
+from media_keys import key_columns, KEY_COLUMNS_WHERE
+
+# Retry delay after the first negative result, doubled on every further one
+NEGATIVE_BACKOFF_BASE_MINUTES = float(os.getenv("NEGATIVE_BACKOFF_BASE_MINUTES", "60"))
+# Upper bound of the retry delay
+NEGATIVE_BACKOFF_MAX_HOURS = float(os.getenv("NEGATIVE_BACKOFF_MAX_HOURS", "72"))
+# Random spread applied to each delay (0.25 = +/-25%) so titles don't retry in lockstep
+NEGATIVE_BACKOFF_JITTER = float(os.getenv("NEGATIVE_BACKOFF_JITTER", "0.25"))
+
+# Multiplier of the base delay per reason. Missing torrents are usually a
+# title that is not out yet and shows up soon after release, so it retries
+# fastest; a TMDb ID without an IMDb ID rarely changes.
+REASON_FACTORS = {
+    "no_torrents": 1,
+    "no_candidates": 2,
+    "imdb_not_found": 6
+}
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS negative_results (
+    tmdb_id INTEGER NOT NULL,
+    media_type TEXT NOT NULL,
+    seasons TEXT NOT NULL,
+    is4k INTEGER NOT NULL,
+    reason TEXT NOT NULL,
+    failures INTEGER NOT NULL,
+    first_failed_at REAL NOT NULL,
+    last_failed_at REAL NOT NULL,
+    retry_at REAL NOT NULL,
+    request TEXT,
+    PRIMARY KEY (tmdb_id, media_type, seasons, is4k, reason)
+);
+""")
+
+
+def retry_delay(reason: str, failures: int) -> float:
+    """Seconds to wait after the given number of consecutive failures for a reason."""
+    base = NEGATIVE_BACKOFF_BASE_MINUTES * 60 * REASON_FACTORS.get(reason, 1)
+    delay = min(base * 2 ** (failures - 1), NEGATIVE_BACKOFF_MAX_HOURS * 3600)
+    return delay * random.uniform(1 - NEGATIVE_BACKOFF_JITTER, 1 + NEGATIVE_BACKOFF_JITTER)
+
+
+def backed_off(key: Tuple) -> Optional[Dict[str, Any]]:
+    """Return the pending backoff of a media key if it must not be retried yet, otherwise None."""
+    row = get_connection().execute(
+        "SELECT reason, failures, retry_at FROM negative_results "
+        f"WHERE {KEY_COLUMNS_WHERE} AND retry_at > ? ORDER BY retry_at DESC LIMIT 1",
+        (*key_columns(key), time.time())
+    ).fetchone()
+    if row is None:
+        return None
+    return {"reason": row[0], "failures": row[1], "retry_at": row[2]}
+
+
+def record_failure(key: Tuple, reason: str, request: Optional[Dict[str, Any]] = None) -> float:
+    """
+    Count a negative result for a media key and schedule its next attempt,
+    keeping the request so it can be retried without refetching it. Returns
+    the retry time.
+    """
+    connection = get_connection()
+    now = time.time()
+    row = connection.execute(
+        f"SELECT failures, first_failed_at FROM negative_results WHERE {KEY_COLUMNS_WHERE} AND reason = ?",
+        (*key_columns(key), reason)
+    ).fetchone()
+    failures, first_failed_at = (row[0] + 1, row[1]) if row else (1, now)
+    retry_at = now + retry_delay(reason, failures)
+    connection.execute(
+        "INSERT OR REPLACE INTO negative_results "
+        "(tmdb_id, media_type, seasons, is4k, reason, failures, first_failed_at, last_failed_at, retry_at, request) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (*key_columns(key), reason, failures, first_failed_at, now, retry_at, json.dumps(request) if request else None)
+    )
+    logger.info(f"{key} failed with {reason} {failures} time(s), next attempt in {(retry_at - now) / 3600:.1f}h")
+    return retry_at
+
+
+def due_requests() -> List[Dict[str, Any]]:
+    """
+    Claim the stored requests whose every backoff has expired, for the sync
+    to retry: per media key, the request of its most recent failure. Each
+    claimed key is pushed back by its next backoff step, so a retry that
+    ends without a recorded reason (or never ends) isn't handed out again
+    on every sync; a recorded outcome overwrites the claim.
+    """
+    connection = get_connection()
+    now = time.time()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        rows = connection.execute(
+            "SELECT tmdb_id, media_type, seasons, is4k, reason, failures, request FROM ("
+            "  SELECT *, "
+            "    ROW_NUMBER() OVER (PARTITION BY tmdb_id, media_type, seasons, is4k "
+            "                       ORDER BY request IS NOT NULL DESC, last_failed_at DESC) AS latest, "
+            "    MAX(retry_at) OVER (PARTITION BY tmdb_id, media_type, seasons, is4k) AS due_at "
+            "  FROM negative_results"
+            ") WHERE latest = 1 AND request IS NOT NULL AND due_at <= ?",
+            (now,)
+        ).fetchall()
+        for row in rows:
+            connection.execute(
+                f"UPDATE negative_results SET retry_at = ? WHERE {KEY_COLUMNS_WHERE}",
+                (now + retry_delay(row[4], row[5] + 1), *row[:4])
+            )
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    return [json.loads(row[6]) for row in rows]
+
+
+def clear_key(key: Tuple) -> None:
+    """Drop the backoffs of one media key, after it succeeded or when a retry is forced."""
+    get_connection().execute(f"DELETE FROM negative_results WHERE {KEY_COLUMNS_WHERE}", key_columns(key))
+
+
+def update(key: Tuple, success: bool, reason: Optional[str], request: Optional[Dict[str, Any]] = None) -> None:
+    """Apply a pipeline outcome: a success clears the key's backoff, a negative result extends it."""
+    try:
+        if success:
+            clear_key(key)
+        elif reason:
+            record_failure(key, reason, request)
+    except sqlite3.Error as e:
+        logger.warning(f"Could not update the backoff of {key}: {e}")
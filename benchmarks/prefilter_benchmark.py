@@ -0,0 +1,112 @@
+"""
+Compare ranking Torrentio listings with and without the title pre-filter.
+
+Usage (from the repository root):
+    python benchmarks/prefilter_benchmark.py
+    python benchmarks/prefilter_benchmark.py listing.json [listing.json.gz ...]
+    python benchmarks/prefilter_benchmark.py --fetch movie:tt0133093 --fetch tv:tt0903747
+
+Listings are Torrentio stream responses ({"streams": [...]}) saved to disk,
+plain or gzipped, or fetched live with --fetch media_type:imdb_id. Without
+either, the corpus in benchmarks/corpus is used. Titles go through the
+shipped path: CandidateTable titles (release line, no stats line) ranked by
+RankingService in-process, on an empty rank cache (cold) and again on the
+filled one (warm). Both paths must keep the same fetchable torrents; the
+script exits non-zero if they differ.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loguru import logger
+
+from settings import profile_settings
+from ranking import RankingService, STANDARD_PROFILE
+from rank_cache import RankCache
+from stream_table import CandidateTable
+from ranking_benchmark import load_corpus, CORPUS_DIR
+
+
+def load_items(paths, fetches):
+    if not paths and not fetches:
+        paths = [os.path.join(CORPUS_DIR, name) for name in os.listdir(CORPUS_DIR) if name.endswith((".json", ".json.gz"))]
+    listings, _ = load_corpus(paths)
+    stream_lists = [listing.get("streams", []) for listing in listings]
+    if fetches:
+        from utils import query_torrentio
+        for fetch in fetches:
+            media_type, imdb_id = fetch.split(":", 1)
+            stream_lists.append((query_torrentio(imdb_id, media_type) or {}).get("streams", []))
+    items = []
+    for streams in stream_lists:
+        table = CandidateTable.from_streams(streams)
+        items.extend(zip(table.titles, table.info_hashes))
+    return items
+
+
+def service(use_prefilter):
+    ranking = RankingService(processes=0, use_prefilter=use_prefilter)
+    ranking.cache = RankCache(persist=False)
+    return ranking
+
+
+def fetchable(items, results):
+    return {info_hash for (_, info_hash), result in zip(items, results) if result is not None and result.fetch}
+
+
+def best_time(function, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("listings", nargs="*", help="Saved Torrentio stream responses")
+    parser.add_argument("--fetch", action="append", default=[], help="media_type:imdb_id to fetch from Torrentio")
+    parser.add_argument("--profile", default=STANDARD_PROFILE, help="Ranking profile to rank with")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per path, the best is reported")
+    args = parser.parse_args()
+    # Per-call pipeline logging would be timed along with the ranking
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    if args.profile not in profile_settings:
+        parser.error(f"unknown profile {args.profile}, active profiles: {', '.join(profile_settings)}")
+    items = load_items(args.listings, args.fetch)
+    if not items:
+        parser.error("no streams to rank")
+
+    timings = {}
+    results = {}
+    for use_prefilter in (False, True):
+        cold, results[use_prefilter] = best_time(lambda: service(use_prefilter).rank(items, args.profile), args.repeat)
+        warm_service = service(use_prefilter)
+        warm_service.rank(items, args.profile)
+        warm, _ = best_time(lambda: warm_service.rank(items, args.profile), args.repeat)
+        timings[use_prefilter] = (cold, warm)
+    prefilter = service(True).prefilter(args.profile)
+    rejected = prefilter.filter([title for title, _ in items]).count(False)
+
+    print(f"titles:            {len(items)}")
+    print(f"pre-filtered out:  {rejected} ({rejected / len(items):.1%})")
+    for label, use_prefilter in (("rank only", False), ("pre-filter + rank", True)):
+        cold, warm = timings[use_prefilter]
+        print(f"{label + ':':<18} cold {cold * 1000:.1f} ms ({len(items) / cold:.0f} titles/s), warm {warm * 1000:.1f} ms")
+    print(f"speedup:           cold {timings[False][0] / timings[True][0]:.2f}x, warm {timings[False][1] / timings[True][1]:.2f}x")
+    baseline, filtered = fetchable(items, results[False]), fetchable(items, results[True])
+    if baseline != filtered:
+        print(f"MISMATCH: {len(baseline ^ filtered)} torrents differ between the two paths")
+        sys.exit(1)
+    print(f"fetchable:         {len(baseline)} torrents, identical on both paths")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Measure ranking throughput and the candidate selection loop over the
+synthetic Torrentio-format listing corpus in benchmarks/corpus (plus any
+real listings recorded there with record_corpus.py).
+
+Usage (from the repository root):
+    python benchmarks/ranking_benchmark.py
+    python benchmarks/ranking_benchmark.py --output before.json
+    python benchmarks/ranking_benchmark.py --compare before.json --output after.json
+
+For every listing it reports:
+  parse_and_rank  RTN parse + score of every title against every active
+                  profile (rank_batch, no pre-filter or cache); titles/s
+                  is derived from it
+  table           Torrentio streams into a CandidateTable
+  prefilter       Pre-filter verdicts for every title
+  rank_cold       RankingService.rank on an empty rank cache
+  rank_warm       The same titles again, served from the rank cache
+  select_sort     Full sort of the fetchable rows, as RD-first mode ranks
+  select_stream   Streaming selection against a simulated RD cache
+
+Timings are the best of --repeat runs, in-process (no ranking pool) so
+results don't depend on core count. Peak memory of each stage is taken in
+a separate tracemalloc pass so tracing doesn't skew the timings. Results
+carry the git commit, corpus digest, settings fingerprint and RTN
+version; --compare warns when any of those differ, since the numbers are
+then not comparable.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from importlib import metadata
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loguru import logger
+
+from settings import rtn, profile_settings
+from ranking import RankingService, rank_batch, STANDARD_PROFILE
+from rank_cache import RankCache
+from prefilter import TitlePrefilter
+from stream_table import CandidateTable
+from candidates import StreamingSelection
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+RD_AVAILABILITY_BASE_URL = "https://api.real-debrid.com/rest/1.0/torrents/instantAvailability"
+STAGES = ["parse_and_rank", "table", "prefilter", "rank_cold", "rank_warm", "select_sort", "select_stream"]
+
+
+def load_corpus(paths):
+    listings = []
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        with open(path, "rb") as file:
+            data = file.read()
+        digest.update(data)
+        listing = json.loads(gzip.decompress(data) if path.endswith(".gz") else data)
+        listing.setdefault("name", os.path.basename(path).split(".")[0])
+        listings.append(listing)
+    return listings, digest.hexdigest()[:16]
+
+
+def simulated_availability(rate):
+    # Deterministic stand-in for RD instantAvailability: a fixed share of hashes is cached
+    cutoff = int(rate * 256)
+
+    def lookup(info_hashes):
+        return {info_hash: {0: {}} if int(info_hash[-2:], 16) < cutoff else {} for info_hash in info_hashes}
+    return lookup
+
+
+def fresh_service():
+    service = RankingService(processes=0)
+    service.cache = RankCache(persist=False)
+    return service
+
+
+def stage_functions(listing, profile, availability):
+    """The stages of one listing as callables, each run against fresh state."""
+    streams = listing["streams"]
+    table = CandidateTable.from_streams(streams)
+    items = list(zip(table.titles, table.info_hashes))
+    prefilter = TitlePrefilter(profile_settings[profile])
+    warm = fresh_service()
+    warm.rank(items, profile)
+    ranked = fresh_service()
+    table.set_ranks(ranked.rank(items, profile))
+    fetchable = table.fetchable()
+
+    def select_stream():
+        selection = StreamingSelection(table, fetchable, RD_AVAILABILITY_BASE_URL)
+        while not selection.done:
+            rows = selection.next_batch()
+            selection.offer(rows, availability([table.info_hashes[row] for row in rows]))
+        return selection.result()
+
+    return len(items), {
+        "parse_and_rank": lambda: rank_batch(items, profile_settings, rtn.ranking_model),
+        "table": lambda: CandidateTable.from_streams(streams),
+        "prefilter": lambda: prefilter.filter(table.titles),
+        "rank_cold": lambda: fresh_service().rank(items, profile),
+        "rank_warm": lambda: warm.rank(items, profile),
+        "select_sort": lambda: table.top_k(len(fetchable), fetchable),
+        "select_stream": select_stream
+    }
+
+
+def best_time(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def peak_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(listings, profile, repeat, availability):
+    results = {}
+    for listing in listings:
+        titles, stages = stage_functions(listing, profile, availability)
+        timings = {name: best_time(stages[name], repeat) for name in STAGES}
+        memory = {name: peak_memory(stages[name]) for name in STAGES}
+        results[listing["name"]] = {
+            "kind": listing.get("kind"),
+            "source": listing.get("source"),
+            "titles": titles,
+            "titles_per_second": titles / timings["parse_and_rank"],
+            "stages_ms": {name: timing * 1000 for name, timing in timings.items()},
+            "peak_memory_kb": {name: peak / 1024 for name, peak in memory.items()}
+        }
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def environment(corpus_digest, profile):
+    try:
+        rtn_version = metadata.version("rank-torrent-name")
+    except metadata.PackageNotFoundError:
+        rtn_version = "unknown"
+    return {
+        "commit": git_commit(),
+        "corpus": corpus_digest,
+        "profile": profile,
+        "profiles": list(profile_settings),
+        "settings": fresh_service().fingerprint,
+        "rtn": rtn_version,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count()
+    }
+
+
+def print_results(report):
+    print(f"commit {report['environment']['commit']}, corpus {report['environment']['corpus']}, "
+          f"profile {report['environment']['profile']} of {', '.join(report['environment']['profiles'])}")
+    print(f"{'listing':<28} {'titles':>6} {'titles/s':>9} " + " ".join(f"{name:>14}" for name in STAGES))
+    for name, result in report["listings"].items():
+        print(f"{name:<28} {result['titles']:>6} {result['titles_per_second']:>9.0f} "
+              + " ".join(f"{result['stages_ms'][stage]:>11.2f} ms" for stage in STAGES))
+    print(f"{'peak memory':<45} " + " ".join(
+        f"{max(result['peak_memory_kb'][stage] for result in report['listings'].values()):>11.0f} KB" for stage in STAGES
+    ))
+    print(f"max RSS: {report['max_rss_kb']} KB")
+
+
+def print_comparison(before, after):
+    for key in ("corpus", "profile", "settings", "rtn", "python", "machine"):
+        if before["environment"].get(key) != after["environment"].get(key):
+            print(f"WARNING: {key} differs ({before['environment'].get(key)} -> {after['environment'].get(key)}), "
+                  f"results are not directly comparable")
+    print(f"\n{before['environment']['commit']} -> {after['environment']['commit']} (time ratio, <1 is faster)")
+    print(f"{'listing':<28} {'titles/s':>9} " + " ".join(f"{name:>14}" for name in STAGES))
+    for name, result in after["listings"].items():
+        old = before["listings"].get(name)
+        if old is None:
+            continue
+        throughput = result["titles_per_second"] / old["titles_per_second"]
+        ratios = [result["stages_ms"][stage] / old["stages_ms"][stage] if old["stages_ms"].get(stage) else float("nan")
+                  for stage in STAGES]
+        print(f"{name:<28} {throughput:>8.2f}x " + " ".join(f"{ratio:>13.2f}x" for ratio in ratios))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("listings", nargs="*", help="Corpus files, all of benchmarks/corpus by default")
+    parser.add_argument("--profile", default=STANDARD_PROFILE, help="Ranking profile to rank and select with")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage, the best is reported")
+    parser.add_argument("--rd-cached", type=float, default=0.3, help="Share of hashes the simulated RD has cached")
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--compare", help="Results JSON of an earlier run to compare against")
+    args = parser.parse_args()
+    # Per-call pipeline logging would be timed along with the stages
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    if args.profile not in profile_settings:
+        parser.error(f"unknown profile {args.profile}, active profiles: {', '.join(profile_settings)}")
+    paths = args.listings or [os.path.join(CORPUS_DIR, name) for name in os.listdir(CORPUS_DIR)
+                              if name.endswith((".json", ".json.gz"))]
+    listings, corpus_digest = load_corpus(paths)
+    if not listings:
+        parser.error("no listings to benchmark")
+
+    report = {
+        "environment": environment(corpus_digest, args.profile),
+        "listings": run(listings, args.profile, args.repeat, simulated_availability(args.rd_cached)),
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+    print_results(report)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as file:
+            print_comparison(json.load(file), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Build the Torrentio listing corpus used by ranking_benchmark.py.
+
+Usage (from the repository root):
+    python benchmarks/record_corpus.py record movie:tt0133093:matrix --kind movie
+    python benchmarks/record_corpus.py record tv:tt0903747:breaking_bad --kind tv_pack
+    python benchmarks/record_corpus.py synthesize
+
+"record" saves live Torrentio responses as benchmarks/corpus/<name>.json.gz.
+"synthesize" regenerates the checked-in corpus, synthetic_*.json.gz (no
+real Torrentio listings are checked in): deterministic listings in
+Torrentio's stream format (release line, file line, seeders/size/source
+line) modelled on real movie, TV season pack and long-running anime
+listings, including the CAM/TS, sample and low-resolution noise real
+listings carry. Regenerating it yields byte-identical files, so benchmark
+results stay comparable across commits. Record real listings alongside
+them when measuring against production data.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+SOURCES = ["ThePirateBay", "1337x", "RARBG", "YTS", "EZTV", "TorrentGalaxy", "MagnetDL", "Nyaa", "AniDex", "HorribleSubs"]
+RESOLUTIONS = [("2160p", 0.12), ("1080p", 0.45), ("720p", 0.25), ("480p", 0.08), ("", 0.1)]
+QUALITIES = [("BluRay", 0.2), ("WEB-DL", 0.22), ("WEBRip", 0.15), ("HDTV", 0.08), ("BDRip", 0.07), ("REMUX", 0.05),
+             ("DVDRip", 0.05), ("HDRip", 0.06), ("CAM", 0.04), ("TS", 0.03), ("HDTS", 0.03), ("TC", 0.02)]
+CODECS = ["x264", "x265", "H.264", "H.265", "HEVC", "AVC", "10bit.x265"]
+AUDIO = ["", "AAC", "AAC5.1", "DDP5.1", "DTS", "DTS-HD.MA.5.1", "TrueHD.7.1.Atmos", "AC3"]
+EXTRAS = ["", "", "", "HDR", "HDR10", "DV", "REPACK", "PROPER", "EXTENDED", "IMAX", "MULTi", "SUBBED", "DUAL"]
+GROUPS = ["SPARKS", "RARBG", "YIFY", "GalaxyRG", "NTb", "FLUX", "TEPES", "QxR", "PSA", "Tigole", "ION10", "EVO", "CMRG"]
+ANIME_GROUPS = ["SubsPlease", "Erai-raws", "HorribleSubs", "Judas", "EMBER", "ASW", "Anime Time", "DKB", "Ohys-Raws"]
+
+# name, kind, title, year, seasons, episodes per season, streams
+LISTINGS = [
+    ("synthetic_movie_blockbuster", "movie", "Oppenheimer", 2023, 0, 0, 450),
+    ("synthetic_movie_classic", "movie", "The Matrix", 1999, 0, 0, 300),
+    ("synthetic_tv_season_packs", "tv_pack", "Breaking Bad", 2008, 5, 13, 900),
+    ("synthetic_tv_long_running", "tv_pack", "The Simpsons", 1989, 34, 22, 1400),
+    ("synthetic_anime_huge", "anime", "One Piece", 1999, 21, 60, 3500),
+]
+
+
+def _weighted(rng, choices):
+    return rng.choices([value for value, _ in choices], weights=[weight for _, weight in choices])[0]
+
+
+def _release(rng, title, year, kind, seasons, episodes):
+    dotted = title.replace(" ", ".")
+    resolution = _weighted(rng, RESOLUTIONS)
+    parts = [dotted]
+    if kind == "movie":
+        parts.append(str(year))
+        file_suffix = ""
+    else:
+        season = rng.randint(1, seasons)
+        pack = rng.random()
+        if pack < 0.15:
+            parts.append(f"S01-S{seasons:02d}.COMPLETE")
+            file_suffix = f".S{season:02d}E{rng.randint(1, episodes):02d}"
+        elif pack < 0.65:
+            parts.append(f"S{season:02d}")
+            file_suffix = f".S{season:02d}E{rng.randint(1, episodes):02d}"
+        else:
+            parts.append(f"S{season:02d}E{rng.randint(1, episodes):02d}")
+            file_suffix = ""
+    parts += [part for part in (resolution, rng.choice(EXTRAS), _weighted(rng, QUALITIES), rng.choice(AUDIO), rng.choice(CODECS)) if part]
+    name = ".".join(parts) + f"-{rng.choice(GROUPS)}"
+    return name, resolution, name + file_suffix + rng.choice([".mkv", ".mkv", ".mp4", ".avi"])
+
+
+def _anime_release(rng, title, seasons, episodes):
+    group = rng.choice(ANIME_GROUPS)
+    resolution = rng.choice(["1080p", "1080p", "720p", "480p", "2160p"])
+    crc = "%08X" % rng.getrandbits(32)
+    if rng.random() < 0.2:
+        season = rng.randint(1, seasons)
+        name = f"[{group}] {title} (Season {season}) [{resolution}][HEVC x265 10bit][Multi-Subs] (Batch)"
+        file_name = f"[{group}] {title} - {rng.randint(1, seasons * episodes):03d} [{resolution}].mkv"
+    else:
+        episode = rng.randint(1, seasons * episodes)
+        name = f"[{group}] {title} - {episode:04d} ({resolution}) [{crc}].mkv"
+        file_name = name
+    return name, resolution, file_name
+
+
+def _size_gb(rng, resolution, kind):
+    base = {"2160p": 18.0, "1080p": 6.0, "720p": 2.5, "480p": 0.9}.get(resolution, 1.5)
+    if kind != "movie":
+        base *= rng.choice([0.15, 0.15, 1.0, 8.0])
+    return base * rng.uniform(0.3, 2.0)
+
+
+def synthesize_listing(name, kind, title, year, seasons, episodes, count):
+    rng = random.Random(name)
+    streams = []
+    for index in range(count):
+        if kind == "anime":
+            release, resolution, file_name = _anime_release(rng, title, seasons, episodes)
+        else:
+            release, resolution, file_name = _release(rng, title, year, kind, seasons, episodes)
+        if rng.random() < 0.03:
+            file_name = "Sample/" + file_name.replace(".mkv", ".sample.mkv")
+        seeders = int(rng.paretovariate(1.2)) - 1
+        size = _size_gb(rng, resolution, kind)
+        size_text = f"{size:.2f} GB" if size >= 1 else f"{size * 1024:.0f} MB"
+        stats = f"👤 {seeders} 💾 {size_text} ⚙️ {rng.choice(SOURCES)}"
+        stream = {
+            "name": f"Torrentio\n{resolution or 'Unknown'}",
+            "title": f"{release}\n{file_name}\n{stats}",
+            "infoHash": hashlib.sha1(f"{name}:{index}".encode()).hexdigest()
+        }
+        if kind != "movie" or rng.random() < 0.5:
+            stream["fileIdx"] = rng.randint(0, 40 if kind != "movie" else 3)
+        streams.append(stream)
+    return {"name": name, "kind": kind, "source": "synthetic", "streams": streams}
+
+
+def write_listing(listing):
+    os.makedirs(CORPUS_DIR, exist_ok=True)
+    path = os.path.join(CORPUS_DIR, f"{listing['name']}.json.gz")
+    # mtime=0 keeps the archive byte-identical between runs
+    with open(path, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as file:
+        file.write(json.dumps(listing, ensure_ascii=False, sort_keys=True).encode())
+    print(f"{path}: {len(listing['streams'])} streams")
+
+
+def record(targets, kind):
+    from utils import query_torrentio
+    for target in targets:
+        media_type, imdb_id, name = target.split(":", 2)
+        response = query_torrentio(imdb_id, media_type)
+        if not response or not response.get("streams"):
+            print(f"{target}: no streams, skipped")
+            continue
+        write_listing({
+            "name": name,
+            "kind": kind,
+            "source": "torrentio",
+            "imdb_id": imdb_id,
+            "recorded_at": int(time.time()),
+            "streams": response["streams"]
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="Save live Torrentio listings")
+    record_parser.add_argument("targets", nargs="+", help="media_type:imdb_id:name")
+    record_parser.add_argument("--kind", choices=["movie", "tv_pack", "anime"], required=True)
+    commands.add_parser("synthesize", help="Regenerate the synthetic corpus")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.targets, args.kind)
+    else:
+        for listing in LISTINGS:
+            write_listing(synthesize_listing(*listing))
+
+
+if __name__ == "__main__":
+    main()
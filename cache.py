@@ -0,0 +1,196 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Hashable, Optional, Dict, List, Tuple
+
+# Torrentio stream listings: fresh for TORRENTIO_CACHE_TTL seconds, then served
+# stale (while revalidating in the background) for TORRENTIO_CACHE_STALE_TTL more
+TORRENTIO_CACHE_TTL = int(os.getenv("TORRENTIO_CACHE_TTL", "900"))
+TORRENTIO_CACHE_STALE_TTL = int(os.getenv("TORRENTIO_CACHE_STALE_TTL", "3600"))
+TORRENTIO_CACHE_SIZE = int(os.getenv("TORRENTIO_CACHE_SIZE", "256"))
+
+# Real-Debrid instant availability: cached hashes change slowly, uncached ones
+# may get cached by another user at any time, so negatives expire sooner
+RD_CACHE_SIZE = int(os.getenv("RD_CACHE_SIZE", "20000"))
+RD_CACHE_TTL = int(os.getenv("RD_CACHE_TTL", "21600"))
+RD_CACHE_NEGATIVE_TTL = int(os.getenv("RD_CACHE_NEGATIVE_TTL", "1800"))
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded mapping that evicts the least recently used
+    entry once max_size is exceeded.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+@dataclass
+class CachedResponse:
+    data: Any
+    fetched_at: float = field(default_factory=time.monotonic)
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+    def validators(self) -> Dict[str, str]:
+        """Conditional request headers for revalidating this response."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """
+    LRU cache of upstream responses with a freshness TTL and a
+    stale-while-revalidate window. Callers ask lookup() for a usable entry and
+    whether it needs a background refresh; claim_refresh() makes sure only one
+    refresh per key runs at a time.
+    """
+
+    def __init__(self, ttl: float, stale_ttl: float, max_size: int):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = LRUCache(max_size)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        return self._entries.get(key)
+
+    def lookup(self, key: Hashable) -> tuple[Optional[CachedResponse], bool]:
+        """
+        Returns (entry, needs_refresh). entry is None when there is nothing
+        servable and the caller must fetch synchronously.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, False
+        if entry.age <= self.ttl:
+            return entry, False
+        if entry.age <= self.ttl + self.stale_ttl:
+            return entry, True
+        return None, False
+
+    def store(self, key: Hashable, data: Any, etag: Optional[str] = None, last_modified: Optional[str] = None) -> CachedResponse:
+        entry = CachedResponse(data=data, etag=etag, last_modified=last_modified)
+        self._entries.set(key, entry)
+        return entry
+
+    def touch(self, key: Hashable, entry: CachedResponse) -> None:
+        """Mark an entry fresh again after a 304 Not Modified."""
+        entry.fetched_at = time.monotonic()
+        self._entries.set(key, entry)
+
+    def claim_refresh(self, key: Hashable) -> bool:
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def release_refresh(self, key: Hashable) -> None:
+        with self._lock:
+            self._refreshing.discard(key)
+
+
+def hash_key(info_hash: str) -> bytes:
+    """
+    Compact cache key for an infohash: the 20 raw bytes of a hex SHA-1 hash,
+    or the lowercased string for anything else (e.g. base32 hashes).
+    """
+    info_hash = info_hash.lower()
+    if len(info_hash) == 40:
+        try:
+            return bytes.fromhex(info_hash)
+        except ValueError:
+            pass
+    return info_hash.encode()
+
+
+class AvailabilityCache:
+    """
+    Thread-safe LRU cache of Real-Debrid instant availability, mapping an
+    infohash to its file map. Positive and negative (empty file map) results
+    expire after separate TTLs.
+    """
+
+    def __init__(self, max_size: int, ttl: float, negative_ttl: float):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = LRUCache(max_size)
+
+    def get_many(self, info_hashes: List[str]) -> Tuple[Dict[str, dict], List[str]]:
+        """
+        Split lowercase hashes into (cached results, misses), dropping
+        expired entries on the way.
+        """
+        hits, misses = {}, []
+        now = time.monotonic()
+        for info_hash in info_hashes:
+            key = hash_key(info_hash)
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                hits[info_hash] = entry[0]
+            else:
+                if entry is not None:
+                    self._entries.pop(key)
+                misses.append(info_hash)
+        return hits, misses
+
+    def put_many(self, results: Dict[str, dict]) -> None:
+        now = time.monotonic()
+        for info_hash, files in results.items():
+            expires_at = now + (self.ttl if files else self.negative_ttl)
+            self._entries.set(hash_key(info_hash), (files, expires_at))
+
+
+# Shared by the sync queue workers and the async webhook path
+rd_availability_cache = AvailabilityCache(
+    max_size=RD_CACHE_SIZE,
+    ttl=RD_CACHE_TTL,
+    negative_ttl=RD_CACHE_NEGATIVE_TTL
+)
+
+torrentio_cache = ResponseCache(
+    ttl=TORRENTIO_CACHE_TTL,
+    stale_ttl=TORRENTIO_CACHE_STALE_TTL,
+    max_size=TORRENTIO_CACHE_SIZE
+)
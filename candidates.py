@@ -0,0 +1,180 @@
+import os
+from typing import Iterator, List, Dict, Any, NamedTuple, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from ranking import ranking_service, RankingService, STANDARD_PROFILE
+from stream_table import CandidateTable
+
+# Upper bound for a batched /torrents/instantAvailability/h1/h2/... URL
+RD_MAX_URL_LENGTH = int(os.getenv("RD_MAX_URL_LENGTH", "2000"))
+
+# Rank every Torrentio title locally before asking Real-Debrid, and only ask
+# about the best RANK_FIRST_TOP_N of them
+RANK_FIRST = os.getenv("RANK_FIRST", "n").lower() == "y"
+RANK_FIRST_TOP_N = int(os.getenv("RANK_FIRST_TOP_N", "10"))
+
+# Streams below this many seeders or above this size are not ranked, 0 disables the bound
+CANDIDATE_MIN_SEEDERS = int(os.getenv("CANDIDATE_MIN_SEEDERS", "0"))
+CANDIDATE_MAX_SIZE_GB = float(os.getenv("CANDIDATE_MAX_SIZE_GB", "0"))
+
+# Look up RD availability best candidate first, one URL-length-bounded
+# batch at a time, and stop at the first cached one instead of looking up
+# every stream (takes precedence over RANK_FIRST)
+SELECT_STREAMING = os.getenv("SELECT_STREAMING", "n").lower() == "y"
+
+
+class RankedCandidate(NamedTuple):
+    info_hash: str
+    file_idx: int
+    title: str  # Parsed title
+    rank: int
+
+
+def collect_info_hashes(streams: List[Dict[str, Any]]) -> List[str]:
+    """
+    Collect the deduplicated, lowercased infoHashes of a Torrentio response,
+    keeping the order in which Torrentio listed them.
+    """
+    seen = set()
+    hashes = []
+    for stream in streams:
+        info_hash = stream.get('infoHash')
+        if not info_hash:
+            continue
+        info_hash = info_hash.lower()
+        if info_hash not in seen:
+            seen.add(info_hash)
+            hashes.append(info_hash)
+    return hashes
+
+
+def chunk_hashes(hashes: List[str], base_url: str, max_url_length: int = RD_MAX_URL_LENGTH) -> Iterator[List[str]]:
+    """
+    Split hashes into batches whose "{base_url}/h1/h2/..." URL stays within
+    max_url_length. Every batch holds at least one hash.
+    """
+    budget = max_url_length - len(base_url)
+    chunk: List[str] = []
+    length = 0
+    for info_hash in hashes:
+        segment = len(info_hash) + 1  # Leading "/"
+        if chunk and length + segment > budget:
+            yield chunk
+            chunk, length = [], 0
+        chunk.append(info_hash)
+        length += segment
+    if chunk:
+        yield chunk
+
+
+def _rankable_rows(table: CandidateTable) -> np.ndarray:
+    return table.within(CANDIDATE_MIN_SEEDERS, int(CANDIDATE_MAX_SIZE_GB * 1024 ** 3))
+
+
+def _fetchable_rows(table: CandidateTable, rows: np.ndarray) -> np.ndarray:
+    fetchable = table.fetchable(rows)
+    logger.info(f"Ranked {len(fetchable)} candidates locally, skipped {len(table) - len(fetchable)} garbage, excluded or filtered titles.")
+    return fetchable
+
+
+def _candidate(table: CandidateTable, row: int) -> RankedCandidate:
+    # Plain ints, NumPy scalars don't serialize to JSON
+    return RankedCandidate(table.info_hashes[row], int(table.file_idx[row]), table.parsed_titles[row], int(table.rank[row]))
+
+
+def _to_candidates(table: CandidateTable, fetchable: np.ndarray, sort: bool) -> List[RankedCandidate]:
+    if sort:
+        fetchable = table.top_k(len(fetchable), fetchable)
+    return [_candidate(table, row) for row in fetchable.tolist()]
+
+
+def rank_table(streams: List[Dict[str, Any]], service: RankingService = ranking_service,
+               profile: str = STANDARD_PROFILE) -> Tuple[CandidateTable, np.ndarray]:
+    """
+    Parse and rank every Torrentio title under a ranking profile into a
+    CandidateTable. Returns the table and its fetchable rows within the
+    seeder and size bounds, in Torrentio order.
+    """
+    table = CandidateTable.from_streams(streams)
+    rows = _rankable_rows(table)
+    rows = rows.tolist()
+    table.set_ranks(service.rank([(table.titles[row], table.info_hashes[row]) for row in rows], profile), rows)
+    return table, _fetchable_rows(table, rows)
+
+
+async def rank_table_async(streams: List[Dict[str, Any]], service: RankingService = ranking_service,
+                           profile: str = STANDARD_PROFILE) -> Tuple[CandidateTable, np.ndarray]:
+    """Like rank_table(), without blocking the event loop while the pool ranks."""
+    table = CandidateTable.from_streams(streams)
+    rows = _rankable_rows(table)
+    rows = rows.tolist()
+    table.set_ranks(await service.rank_async([(table.titles[row], table.info_hashes[row]) for row in rows], profile), rows)
+    return table, _fetchable_rows(table, rows)
+
+
+def rank_streams(streams: List[Dict[str, Any]], sort: bool = True, service: RankingService = ranking_service,
+                 profile: str = STANDARD_PROFILE) -> List[RankedCandidate]:
+    """
+    Parse and rank every Torrentio title, dropping garbage and non-fetch
+    results and streams outside the seeder and size bounds. Returns one
+    candidate per infoHash, best rank (then most seeders) first unless sort
+    is False, in which case Torrentio order is kept.
+    """
+    return _to_candidates(*rank_table(streams, service, profile), sort)
+
+
+async def rank_streams_async(streams: List[Dict[str, Any]], sort: bool = True, service: RankingService = ranking_service,
+                             profile: str = STANDARD_PROFILE) -> List[RankedCandidate]:
+    """Like rank_streams(), without blocking the event loop while the pool ranks."""
+    return _to_candidates(*await rank_table_async(streams, service, profile), sort)
+
+
+class StreamingSelection:
+    """
+    Walk ranked candidates best first and look up their RD availability one
+    batch at a time, instead of looking up every stream up front. The walk
+    follows the final rank, so the first cached candidate is the best one
+    there is: the walk stops there and nothing after it is sent to RD.
+
+    Each batch fills one instantAvailability URL (see chunk_hashes), so a
+    walk that finds nothing cached takes no more RD calls than looking up
+    every stream would.
+
+    Drive it with next_batch() / offer() until done, then take result().
+    """
+
+    def __init__(self, table: CandidateTable, rows: np.ndarray, base_url: str,
+                 max_url_length: int = RD_MAX_URL_LENGTH):
+        self.table = table
+        order = table.top_k(len(rows), rows).tolist()
+        self._rows = {table.info_hashes[row]: row for row in order}
+        self._batches = chunk_hashes([table.info_hashes[row] for row in order], base_url, max_url_length)
+        self.best: Optional[int] = None
+        self.total = len(order)
+        self.probed = 0
+        self.lookups = 0
+        self.done = not order
+
+    def next_batch(self) -> List[int]:
+        """The next rows to look up, best first; empty once the walk is done."""
+        if self.done:
+            return []
+        return [self._rows[info_hash] for info_hash in next(self._batches, [])]
+
+    def offer(self, rows: List[int], availability: Dict[str, Any]) -> None:
+        """Record the availability of a batch, best first, and stop at its first cached row."""
+        self.lookups += 1
+        self.probed += len(rows)
+        self.best = next((row for row in rows if availability.get(self.table.info_hashes[row])), None)
+        self.done = self.best is not None or self.probed >= self.total
+
+    def result(self) -> List[RankedCandidate]:
+        """The best cached candidate, or nothing if none is cached."""
+        table = self.table
+        logger.info(f"Streaming selection looked up {self.probed} of {self.total} candidates "
+                    f"in {self.lookups} batches, {'found' if self.best is not None else 'no'} cached candidate.")
+        if self.best is None:
+            return []
+        return [_candidate(table, self.best)]
@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+from typing import Optional, Dict, Any
+
+from loguru import logger
+
+# Bounds and starting point for the number of jobs processed concurrently
+WORKERS_MIN = int(os.getenv("WORKERS_MIN", "1"))
+WORKERS_MAX = int(os.getenv("WORKERS_MAX", "10"))
+WORKERS_INITIAL = int(os.getenv("WORKERS_INITIAL", "5"))
+
+# Latency above this multiple of the best observed latency counts as congestion
+LATENCY_TOLERANCE = float(os.getenv("LATENCY_TOLERANCE", "2.5"))
+
+# Upstreams whose health drives the limit
+WATCHED_UPSTREAMS = {"real-debrid", "torrentio"}
+
+# Minimum seconds between two decreases, so one burst of errors backs off once
+DECREASE_COOLDOWN = 5.0
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD concurrency limit for the worker pool. Each job holds a permit while
+    it runs. Healthy upstream responses grow the limit by one per full window
+    of `limit` samples; a 429 or 5xx from a watched upstream halves it, and
+    latency drifting beyond LATENCY_TOLERANCE x the baseline stops growth and
+    shrinks the limit by one. Each upstream keeps its own latency average
+    and baseline, since a normal Torrentio fetch is many times slower than a
+    normal RD call.
+    """
+
+    def __init__(self, minimum: int, maximum: int, initial: int):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.in_use = 0
+        self.increases = 0
+        self.decreases = 0
+        self.latency_ewma: Dict[str, float] = {}
+        self.latency_baseline: Dict[str, float] = {}
+        self._samples = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Take a permit, waiting up to timeout seconds (forever if None). Returns False on timeout."""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.in_use < int(self.limit), timeout):
+                return False
+            self.in_use += 1
+            return True
+
+    def release(self) -> None:
+        with self._condition:
+            self.in_use -= 1
+            self._condition.notify()
+
+    def record(self, upstream: str, latency: float, status_code: int) -> None:
+        """Feed one upstream response into the controller."""
+        if upstream not in WATCHED_UPSTREAMS:
+            return
+        with self._condition:
+            if status_code == 429 or status_code >= 500:
+                self._decrease(0.5, f"{upstream} returned {status_code}")
+                return
+
+            ewma = self.latency_ewma.get(upstream)
+            ewma = latency if ewma is None else 0.8 * ewma + 0.2 * latency
+            self.latency_ewma[upstream] = ewma
+            baseline = self.latency_baseline.get(upstream)
+            if baseline is None or latency < baseline:
+                baseline = latency
+            else:
+                # Let the baseline follow slow, lasting shifts in upstream latency
+                baseline = 0.99 * baseline + 0.01 * latency
+            self.latency_baseline[upstream] = baseline
+
+            if ewma > LATENCY_TOLERANCE * baseline:
+                self._decrease(1.0, f"{upstream} latency {ewma * 1000:.0f} ms", additive=True)
+                return
+
+            self._samples += 1
+            if self._samples >= int(self.limit) and self.limit < self.maximum:
+                self._samples = 0
+                self.limit += 1
+                self.increases += 1
+                self._condition.notify()
+                logger.debug(f"Concurrency limit raised to {int(self.limit)}")
+
+    def _decrease(self, amount: float, reason: str, additive: bool = False) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        self._samples = 0
+        previous = int(self.limit)
+        self.limit = self.limit - amount if additive else self.limit * amount
+        self.limit = float(max(self.minimum, int(self.limit)))
+        if int(self.limit) < previous:
+            self.decreases += 1
+            logger.warning(f"Concurrency limit lowered to {int(self.limit)} ({reason})")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                "limit": int(self.limit),
+                "in_use": self.in_use,
+                "min": self.minimum,
+                "max": self.maximum,
+                "increases": self.increases,
+                "decreases": self.decreases,
+                "latency": {
+                    upstream: {
+                        "ewma_ms": round(ewma * 1000, 1),
+                        "baseline_ms": round(self.latency_baseline[upstream] * 1000, 1)
+                    }
+                    for upstream, ewma in self.latency_ewma.items()
+                }
+            }
+
+
+worker_limiter = AdaptiveConcurrencyLimiter(WORKERS_MIN, WORKERS_MAX, WORKERS_INITIAL)
@@ -0,0 +1,37 @@
+import os
+import sqlite3
+import threading
+from typing import List
+
+# Location of the local state database (ID cache, ledgers, queues). Must be
+# on writable storage: relative paths resolve against the working directory,
+# which is read-only on serverless deploys such as Vercel (point it at /tmp
+# there, keeping in mind /tmp doesn't outlive the instance)
+DB_PATH = os.getenv("DB_PATH", "seerrlite.db")
+
+_local = threading.local()
+_schemas: List[str] = []
+
+
+def register_schema(sql: str) -> None:
+    """
+    Register CREATE ... IF NOT EXISTS statements that every connection runs
+    when it is first opened. Call at import time.
+    """
+    _schemas.append(sql)
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Return this thread's SQLite connection, opened in autocommit mode with WAL
+    journaling so readers never block the writer.
+    """
+    connection = getattr(_local, "connection", None)
+    if connection is None:
+        connection = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        for sql in _schemas:
+            connection.executescript(sql)
+        _local.connection = connection
+    return connection
@@ -0,0 +1,53 @@
+import os
+import sqlite3
+import time
+from typing import Optional, Tuple
+
+from loguru import logger
+
+from db import register_schema, get_connection
+
+# How long a "Trakt has no IMDb ID for this title" answer is trusted
+IMDB_NEGATIVE_TTL = int(os.getenv("IMDB_NEGATIVE_TTL_HOURS", "24")) * 3600
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS imdb_ids (
+    tmdb_id INTEGER NOT NULL,
+    media_type TEXT NOT NULL,
+    imdb_id TEXT,
+    resolved_at REAL NOT NULL,
+    PRIMARY KEY (tmdb_id, media_type)
+);
+""")
+
+
+def get_cached_imdb_id(tmdb_id: int, media_type: str) -> Tuple[bool, Optional[str]]:
+    """
+    Look up a TMDb -> IMDb mapping. Returns (hit, imdb_id); a hit with
+    imdb_id None is a negative entry that has not expired yet. An unusable
+    database counts as a miss, so the caller falls through to Trakt.
+    """
+    try:
+        row = get_connection().execute(
+            "SELECT imdb_id, resolved_at FROM imdb_ids WHERE tmdb_id = ? AND media_type = ?",
+            (tmdb_id, media_type)
+        ).fetchone()
+    except sqlite3.Error as e:
+        logger.warning(f"IMDb ID cache unavailable, asking Trakt: {e}")
+        return False, None
+    if row is None:
+        return False, None
+    imdb_id, resolved_at = row
+    if imdb_id is None and time.time() - resolved_at > IMDB_NEGATIVE_TTL:
+        return False, None
+    return True, imdb_id
+
+
+def store_imdb_id(tmdb_id: int, media_type: str, imdb_id: Optional[str]) -> None:
+    try:
+        get_connection().execute(
+            "INSERT OR REPLACE INTO imdb_ids (tmdb_id, media_type, imdb_id, resolved_at) VALUES (?, ?, ?, ?)",
+            (tmdb_id, media_type, imdb_id, time.time())
+        )
+    except sqlite3.Error as e:
+        logger.warning(f"Could not cache the IMDb ID of tmdbId {tmdb_id}: {e}")
@@ -0,0 +1,195 @@
+import json
+import os
+import threading
+import time
+import uuid
+from queue import Empty
+from typing import Any, Optional, Dict, List, NamedTuple
+
+from loguru import logger
+
+from db import register_schema, get_connection
+
+# Priority levels, lower is served first
+PRIORITY_HIGH = 0      # Webhooks and user-initiated retries
+PRIORITY_NORMAL = 50   # Newly approved requests picked up by incremental sync
+PRIORITY_LOW = 100     # Backlog reconciliation (full syncs)
+
+# Priority points a waiting job gains per minute, so low priority work is
+# never starved: at 10/min a backlog job outranks fresh webhooks after 10 min
+QUEUE_AGING_RATE = float(os.getenv("QUEUE_AGING_RATE", "10"))
+
+# Seconds a claimed job stays invisible to other workers before it is
+# delivered again; every checkpoint extends the lease
+QUEUE_VISIBILITY_TIMEOUT = float(os.getenv("QUEUE_VISIBILITY_TIMEOUT", "600"))
+
+# Deliveries after which a job that keeps failing to finish is dropped
+QUEUE_MAX_DELIVERIES = int(os.getenv("QUEUE_MAX_DELIVERIES", "5"))
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS job_queue (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    source TEXT NOT NULL,
+    request TEXT NOT NULL,
+    force INTEGER NOT NULL,
+    priority INTEGER NOT NULL,
+    sort_key REAL NOT NULL,
+    checkpoint TEXT NOT NULL DEFAULT '{}',
+    deliveries INTEGER NOT NULL DEFAULT 0,
+    lease_until REAL NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_queue_ready ON job_queue (lease_until, sort_key, seq);
+""")
+
+
+class QueuedJob(NamedTuple):
+    """A job as stored in the durable queue."""
+    id: str
+    source: str
+    request: Dict[str, Any]
+    force: bool
+    priority: int
+    checkpoint: Dict[str, Any]
+    deliveries: int
+    created_at: float
+
+
+class DurableJobQueue:
+    """
+    SQLite-backed priority queue with aging and at-least-once delivery.
+
+    get() leases the best ready job for QUEUE_VISIBILITY_TIMEOUT seconds and
+    ack() deletes it once processed. A job whose worker dies is delivered
+    again when its lease runs out, together with the checkpoint its last run
+    saved, so the pipeline can resume from the last completed stage.
+
+    Ordering follows the in-memory queue it replaces: the sort key is
+    priority + aging_rate * enqueued_minutes, with wall-clock minutes so keys
+    stay comparable across restarts. Ties are served FIFO.
+    """
+
+    def __init__(self, aging_rate: float = QUEUE_AGING_RATE, visibility_timeout: float = QUEUE_VISIBILITY_TIMEOUT,
+                 max_deliveries: int = QUEUE_MAX_DELIVERIES):
+        self.aging_rate = aging_rate
+        self.visibility_timeout = visibility_timeout
+        self.max_deliveries = max_deliveries
+        self.owner = uuid.uuid4().hex  # Identifies leases taken by this process
+        self._condition = threading.Condition()
+        self._sentinels = 0
+
+    def put(self, job_id: Optional[str], source: str = "", request: Optional[Dict[str, Any]] = None,
+            force: bool = False, priority: int = PRIORITY_NORMAL) -> None:
+        """Store a job. A job_id of None queues a stop sentinel for one worker, kept in memory only."""
+        if job_id is None:
+            with self._condition:
+                self._sentinels += 1
+                self._condition.notify()
+            return
+        now = time.time()
+        get_connection().execute(
+            "INSERT INTO job_queue (id, source, request, force, priority, sort_key, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, source, json.dumps(request), int(force), priority, priority + self.aging_rate * now / 60, now)
+        )
+        with self._condition:
+            self._condition.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[QueuedJob]:
+        """
+        Lease the next ready job, waiting up to timeout seconds (forever if
+        None). Returns None for a stop sentinel and raises queue.Empty on
+        timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._condition:
+                if self._sentinels:
+                    self._sentinels -= 1
+                    return None
+            job = self._claim()
+            if job is not None:
+                return job
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise Empty
+            # Puts wake waiters early; the poll catches leases expiring
+            with self._condition:
+                self._condition.wait(1.0 if remaining is None else min(1.0, remaining))
+
+    def _claim(self) -> Optional[QueuedJob]:
+        connection = get_connection()
+        while True:
+            now = time.time()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT id, source, request, force, priority, checkpoint, deliveries, created_at "
+                    "FROM job_queue WHERE lease_until <= ? ORDER BY sort_key, seq LIMIT 1",
+                    (now,)
+                ).fetchone()
+                if row is None:
+                    connection.execute("COMMIT")
+                    return None
+                if row[6] >= self.max_deliveries:
+                    connection.execute("DELETE FROM job_queue WHERE id = ?", (row[0],))
+                    connection.execute("COMMIT")
+                    logger.error(f"Dropping job {row[0]} after {row[6]} deliveries without completing")
+                    continue
+                connection.execute(
+                    "UPDATE job_queue SET deliveries = deliveries + 1, lease_until = ?, lease_owner = ? WHERE id = ?",
+                    (now + self.visibility_timeout, self.owner, row[0])
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            if row[6]:
+                logger.info(f"Redelivering job {row[0]} (delivery {row[6] + 1})")
+            return QueuedJob(row[0], row[1], json.loads(row[2]), bool(row[3]), row[4],
+                             json.loads(row[5]), row[6] + 1, row[7])
+
+    def checkpoint(self, job_id: str, checkpoint: Dict[str, Any]) -> None:
+        """Persist a job's progress and extend its lease."""
+        get_connection().execute(
+            "UPDATE job_queue SET checkpoint = ?, lease_until = ? WHERE id = ?",
+            (json.dumps(checkpoint), time.time() + self.visibility_timeout, job_id)
+        )
+
+    def ack(self, job_id: str) -> None:
+        """Remove a processed job from the queue."""
+        get_connection().execute("DELETE FROM job_queue WHERE id = ?", (job_id,))
+        with self._condition:
+            self._condition.notify_all()
+
+    def recover(self) -> List[QueuedJob]:
+        """
+        Release leases held by earlier processes, so jobs interrupted by a
+        crash or redeploy are delivered right away instead of after their
+        visibility timeout, and return every job still queued. Assumes one
+        process owns the database, as with the rest of the local state.
+        """
+        connection = get_connection()
+        released = connection.execute(
+            "UPDATE job_queue SET lease_until = 0, lease_owner = NULL WHERE lease_owner IS NOT NULL AND lease_owner != ?",
+            (self.owner,)
+        ).rowcount
+        rows = connection.execute(
+            "SELECT id, source, request, force, priority, checkpoint, deliveries, created_at FROM job_queue ORDER BY sort_key, seq"
+        ).fetchall()
+        if rows:
+            logger.info(f"Recovered {len(rows)} queued jobs ({released} interrupted)")
+            with self._condition:
+                self._condition.notify_all()
+        return [QueuedJob(row[0], row[1], json.loads(row[2]), bool(row[3]), row[4], json.loads(row[5]), row[6], row[7])
+                for row in rows]
+
+    def join(self) -> None:
+        """Block until every queued job has been acknowledged."""
+        while self.qsize():
+            with self._condition:
+                self._condition.wait(1.0)
+
+    def qsize(self) -> int:
+        return get_connection().execute("SELECT COUNT(*) FROM job_queue").fetchone()[0]
@@ -0,0 +1,114 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Iterator, NamedTuple
+
+from loguru import logger
+
+from models import Job, JobStage
+from ratelimiter import track_wait
+
+# Number of job records kept in memory for the status API
+MAX_TRACKED_JOBS = 1000
+
+
+class PipelineResult(NamedTuple):
+    """Outcome of one pipeline run, shared by coalesced callers."""
+    success: bool
+    message: str
+    status_code: int = 200
+    info_hash: Optional[str] = None
+    torrent_id: Optional[str] = None
+    reason: Optional[str] = None  # Negative-result reason the title is backed off for
+
+
+class JobStore:
+    """
+    Thread-safe, bounded registry of pipeline jobs. Finished jobs are evicted
+    oldest-first once MAX_TRACKED_JOBS is exceeded.
+    """
+
+    def __init__(self, max_jobs: int = MAX_TRACKED_JOBS):
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, source: str, request: Dict[str, Any], force: bool = False, priority: int = 0,
+               job_id: Optional[str] = None, created_at: Optional[float] = None) -> Job:
+        job = Job(
+            id=job_id or uuid.uuid4().hex,
+            source=source,
+            tmdb_id=request['media']['tmdbId'],
+            media_type=request['media']['mediaType'],
+            created_at=created_at or time.time(),
+            force=force,
+            priority=priority,
+            request=request
+        )
+        with self._lock:
+            self._jobs[job.id] = job
+            self._evict()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _evict(self) -> None:
+        if len(self._jobs) <= self.max_jobs:
+            return
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished_at is not None]:
+            del self._jobs[job_id]
+            if len(self._jobs) <= self.max_jobs:
+                return
+
+
+job_store = JobStore()
+
+
+def start_job(job: Optional[Job]) -> None:
+    if job is None:
+        return
+    job.status = "running"
+    job.started_at = time.time()
+
+
+def finish_job(job: Optional[Job], success: bool, message: str) -> None:
+    if job is None or job.finished_at is not None:
+        return
+    job.status = "succeeded" if success else "failed"
+    job.message = message
+    job.finished_at = time.time()
+
+
+@contextmanager
+def job_stage(job: Optional[Job], name: str) -> Iterator[Optional[JobStage]]:
+    """
+    Record the status and timing of one pipeline stage on the job, including
+    the time spent waiting on upstream rate governors. A stage that raises is
+    marked failed and the exception is re-raised.
+    """
+    if job is None:
+        yield None
+        return
+
+    stage = JobStage(name=name, started_at=time.time())
+    job.stages.append(stage)
+    start = time.perf_counter()
+    with track_wait() as waited:
+        try:
+            yield stage
+        except Exception as e:
+            stage.status = "failed"
+            stage.detail = str(e)
+            raise
+        else:
+            if stage.status == "running":
+                stage.status = "succeeded"
+        finally:
+            stage.finished_at = time.time()
+            stage.duration_ms = round((time.perf_counter() - start) * 1000, 2)
+            stage.rate_limit_wait_ms = round(waited[0] * 1000, 2)
+        logger.debug(f"Job {job.id} stage {name} {stage.status} in {stage.duration_ms} ms")
@@ -0,0 +1,76 @@
+import sqlite3
+import time
+from typing import Optional, Dict, Any, Tuple
+
+from loguru import logger
+
+from db import register_schema, get_connection
+from media_keys import key_columns, KEY_COLUMNS_WHERE
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS processed_requests (
+    tmdb_id INTEGER NOT NULL,
+    media_type TEXT NOT NULL,
+    seasons TEXT NOT NULL,
+    is4k INTEGER NOT NULL,
+    request_id INTEGER,
+    media_id INTEGER,
+    info_hash TEXT,
+    torrent_id TEXT,
+    outcome TEXT NOT NULL,
+    message TEXT,
+    processed_at REAL NOT NULL,
+    PRIMARY KEY (tmdb_id, media_type, seasons, is4k)
+);
+""")
+
+
+def get_processed(key: Tuple) -> Optional[Dict[str, Any]]:
+    """
+    Return the ledger entry of a successfully processed media key, or None
+    if it has not been processed (or its last attempt failed, or the
+    database is unusable).
+    """
+    try:
+        row = get_connection().execute(
+            "SELECT request_id, media_id, info_hash, torrent_id, outcome, message, processed_at "
+            f"FROM processed_requests WHERE {KEY_COLUMNS_WHERE} AND outcome = 'succeeded'",
+            key_columns(key)
+        ).fetchone()
+    except sqlite3.Error as e:
+        logger.warning(f"Ledger unavailable, processing {key} without it: {e}")
+        return None
+    if row is None:
+        return None
+    columns = ("request_id", "media_id", "info_hash", "torrent_id", "outcome", "message", "processed_at")
+    return dict(zip(columns, row))
+
+
+def record(key: Tuple, outcome: str, request_id: Optional[int] = None, media_id: Optional[int] = None,
+           info_hash: Optional[str] = None, torrent_id: Optional[str] = None, message: Optional[str] = None) -> None:
+    """Record the outcome of a pipeline run, replacing any previous entry for the key."""
+    try:
+        get_connection().execute(
+            "INSERT OR REPLACE INTO processed_requests "
+            "(tmdb_id, media_type, seasons, is4k, request_id, media_id, info_hash, torrent_id, outcome, message, processed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (*key_columns(key), request_id, media_id, info_hash, torrent_id, outcome, message, time.time())
+        )
+    except sqlite3.Error as e:
+        logger.warning(f"Could not record the {outcome} outcome of {key} in the ledger: {e}")
+
+
+def forget(key: Tuple) -> int:
+    """Drop the ledger entry of a media key so it is processed again. Returns the number removed."""
+    cursor = get_connection().execute(f"DELETE FROM processed_requests WHERE {KEY_COLUMNS_WHERE}", key_columns(key))
+    logger.info(f"Cleared {cursor.rowcount} ledger entries for {key}")
+    return cursor.rowcount
+
+
+def find_media_id(key: Tuple) -> Optional[int]:
+    """Overseerr media id last seen for a media key, if any."""
+    row = get_connection().execute(
+        f"SELECT media_id FROM processed_requests WHERE {KEY_COLUMNS_WHERE} AND media_id IS NOT NULL",
+        key_columns(key)
+    ).fetchone()
+    return row[0] if row else None
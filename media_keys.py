@@ -0,0 +1,18 @@
+from typing import Tuple
+
+# WHERE clause matching the key columns of ledger and backoff tables
+KEY_COLUMNS_WHERE = "tmdb_id = ? AND media_type = ? AND seasons = ? AND is4k = ?"
+
+
+# Key identifying one media request for coalescing duplicate pipeline runs,
+# 4K requests are kept apart from standard requests of the same media
+def pipeline_key(request: dict) -> tuple:
+    media = request['media']
+    seasons = tuple(sorted({season['seasonNumber'] for season in request.get('seasons') or []}))
+    return (media['tmdbId'], media['mediaType'], seasons or None, bool(request.get('is4k')))
+
+
+def key_columns(key: Tuple) -> Tuple[int, str, str, int]:
+    """The (tmdb_id, media_type, seasons, is4k) column values of a pipeline key."""
+    tmdb_id, media_type, seasons, is4k = key
+    return tmdb_id, media_type, ",".join(str(season) for season in seasons or ()), int(is4k)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, Field, field_validator
 from typing import Optional, List, Dict, Any, Literal
 
 MediaType = Literal["movie", "tv"]
@@ -34,3 +34,31 @@ class OverseerrWebhook(BaseModel):
     image: Optional[str] = None
     media: Media
     extra: List[Dict[str, Any]] = []
+
+JobStatus = Literal["queued", "running", "succeeded", "failed"]
+
+class JobStage(BaseModel):
+    name: str
+    status: JobStatus = "running"
+    started_at: float
+    finished_at: Optional[float] = None
+    duration_ms: Optional[float] = None
+    rate_limit_wait_ms: Optional[float] = None
+    detail: Optional[str] = None
+
+class Job(BaseModel):
+    id: str
+    source: Literal["webhook", "backlog", "retry"]
+    tmdb_id: int
+    media_type: MediaType
+    status: JobStatus = "queued"
+    force: bool = False
+    priority: int = 0
+    message: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    stages: List[JobStage] = []
+    deliveries: int = 0
+    checkpoint: Dict[str, Any] = {}
+    request: Dict[str, Any] = Field(default_factory=dict, exclude=True)
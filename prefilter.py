@@ -0,0 +1,70 @@
+import os
+from typing import List, Optional, Iterable
+
+import regex
+from loguru import logger
+from RTN.models import SettingsModel
+from RTN.patterns import IS_TRASH_COMPILED
+
+# Reject titles RTN would never fetch before they reach the full RTN parse.
+# Off by default: it only pays off when many titles are excluded (about 8%
+# of the synthetic corpus is, for a gain within run-to-run noise); measure with
+# benchmarks/prefilter_benchmark.py before turning it on
+RANK_PREFILTER = os.getenv("RANK_PREFILTER", "n").lower() == "y"
+
+# Inline flag letters of the flags that change what a pattern matches
+_INLINE_FLAGS = ((regex.IGNORECASE, "i"), (regex.MULTILINE, "m"), (regex.DOTALL, "s"), (regex.VERBOSE, "x"))
+
+
+def combine_patterns(patterns: Iterable[regex.Pattern]) -> Optional[regex.Pattern]:
+    """
+    Compile patterns into one alternation that matches wherever any of them
+    does, keeping each pattern's flags scoped to its own branch. Returns None
+    for no patterns.
+    """
+    branches = []
+    for pattern in patterns:
+        if not pattern:
+            continue
+        flags = "".join(letter for flag, letter in _INLINE_FLAGS if pattern.flags & flag)
+        branches.append(f"(?{flags}:{pattern.pattern})" if flags else f"(?:{pattern.pattern})")
+    if not branches:
+        return None
+    return regex.compile("|".join(branches))
+
+
+class TitlePrefilter:
+    """
+    Raw-title filter reproducing the part of RTN's fetch check that needs no
+    parsing: a title is never fetched when it matches a trash pattern, or an
+    exclude pattern without also matching a require pattern. Each pattern
+    group is compiled once into a single matcher, so most titles cost one
+    regex pass and only the survivors are parsed and ranked by RTN.
+    """
+
+    def __init__(self, settings: SettingsModel):
+        self._trash = combine_patterns(IS_TRASH_COMPILED)
+        self._exclude = combine_patterns(settings.exclude)
+        self._require = combine_patterns(settings.require)
+        self._reject = combine_patterns([*IS_TRASH_COMPILED, *settings.exclude])
+        self.checked = 0
+        self.rejected = 0
+
+    def accepts(self, title: str) -> bool:
+        """False if RTN would certainly not fetch the title."""
+        if self._reject is None or not self._reject.search(title):
+            return True
+        # Something matched: trash always rejects, an exclude only without a require match
+        if self._trash is not None and self._trash.search(title):
+            return False
+        return self._require is not None and self._require.search(title) is not None
+
+    def filter(self, titles: List[str]) -> List[bool]:
+        """accepts() for every title."""
+        verdicts = [self.accepts(title) for title in titles]
+        rejected = verdicts.count(False)
+        self.checked += len(titles)
+        self.rejected += rejected
+        if rejected:
+            logger.debug(f"Pre-filter rejected {rejected} of {len(titles)} titles")
+        return verdicts
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import re
+import time
+from importlib import metadata
+from typing import Dict, Any, List, Tuple
+
+from loguru import logger
+
+from cache import LRUCache
+from db import register_schema, get_connection
+
+# Ranked titles kept in memory
+RANK_CACHE_SIZE = int(os.getenv("RANK_CACHE_SIZE", "50000"))
+# Also keep ranked titles in the state database so they survive restarts
+RANK_CACHE_PERSIST = os.getenv("RANK_CACHE_PERSIST", "n").lower() == "y"
+# Persisted rankings older than this many days are pruned at startup
+RANK_CACHE_PERSIST_DAYS = int(os.getenv("RANK_CACHE_PERSIST_DAYS", "30"))
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS ranked_titles (
+    title TEXT NOT NULL,
+    info_hash TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    parsed_title TEXT,
+    rank INTEGER,
+    fetch INTEGER,
+    ranked_at REAL NOT NULL,
+    PRIMARY KEY (title, info_hash, fingerprint)
+);
+""")
+
+# Torrentio appends a seeder count to every title, which changes between
+# listings of the same release
+_SEEDERS = re.compile(r"👤\s*\d+")
+
+# Cached marker for titles RTN rejected as garbage
+GARBAGE = "garbage"
+
+
+def normalize_title(title: str) -> str:
+    """Cache key form of a Torrentio title: seeder count dropped, whitespace collapsed."""
+    return " ".join(_SEEDERS.sub("👤", title).split())
+
+
+def settings_fingerprint(settings_data: Dict[str, Any], ranking_model: Any) -> str:
+    """
+    Hash of everything that decides a ranking: the settings of every
+    profile, the ranking model and the RTN version. Any change yields a new
+    fingerprint, so rankings cached under the old one are never served.
+    """
+    try:
+        rtn_version = metadata.version("rank-torrent-name")
+    except metadata.PackageNotFoundError:
+        rtn_version = "unknown"
+    payload = json.dumps({
+        "settings": settings_data,
+        "ranking_model": type(ranking_model).__name__,
+        "ranks": ranking_model.model_dump(),
+        "rtn": rtn_version
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+class RankCache:
+    """
+    Memoized rankings keyed by (normalized title, info hash, settings
+    fingerprint): an in-memory LRU tier in front of an optional SQLite tier.
+    Values are (parsed_title, rank, fetch) tuples, or GARBAGE.
+    """
+
+    def __init__(self, max_size: int = RANK_CACHE_SIZE, persist: bool = RANK_CACHE_PERSIST):
+        self.persist = persist
+        self._memory = LRUCache(max_size)
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, fingerprint: str, items: List[Tuple[str, str]]) -> Tuple[Dict[Tuple[str, str], Any], List[Tuple[str, str]]]:
+        """Split (title, info_hash) pairs into cached values and misses."""
+        found = {}
+        missing = []
+        for item in items:
+            key = (normalize_title(item[0]), item[1].lower(), fingerprint)
+            value = self._memory.get(key)
+            if value is None and self.persist:
+                value = self._load(key)
+                if value is not None:
+                    self._memory.set(key, value)
+            if value is None:
+                missing.append(item)
+            else:
+                found[item] = value
+        self.hits += len(found)
+        self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, fingerprint: str, values: Dict[Tuple[str, str], Any]) -> None:
+        rows = []
+        for (title, info_hash), value in values.items():
+            key = (normalize_title(title), info_hash.lower(), fingerprint)
+            self._memory.set(key, value)
+            if value is GARBAGE:
+                rows.append((*key, None, None, None, time.time()))
+            else:
+                rows.append((*key, value[0], value[1], int(value[2]), time.time()))
+        if self.persist and rows:
+            get_connection().executemany(
+                "INSERT OR REPLACE INTO ranked_titles (title, info_hash, fingerprint, parsed_title, rank, fetch, ranked_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def _load(self, key: Tuple[str, str, str]) -> Any:
+        row = get_connection().execute(
+            "SELECT parsed_title, rank, fetch FROM ranked_titles WHERE title = ? AND info_hash = ? AND fingerprint = ?",
+            key
+        ).fetchone()
+        if row is None:
+            return None
+        return GARBAGE if row[1] is None else (row[0], row[1], bool(row[2]))
+
+    def purge_stale(self, fingerprint: str) -> None:
+        """Drop persisted rankings made under other settings or older than RANK_CACHE_PERSIST_DAYS."""
+        if not self.persist:
+            return
+        cursor = get_connection().execute(
+            "DELETE FROM ranked_titles WHERE fingerprint != ? OR ranked_at < ?",
+            (fingerprint, time.time() - RANK_CACHE_PERSIST_DAYS * 86400)
+        )
+        if cursor.rowcount:
+            logger.info(f"Dropped {cursor.rowcount} stale persisted rankings")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"size": len(self._memory), "hits": self.hits, "misses": self.misses, "persist": self.persist}
@@ -0,0 +1,265 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, List, Tuple, Dict, Any, NamedTuple
+
+from loguru import logger
+from RTN import parse, check_fetch, get_rank
+from RTN.models import SettingsModel, DefaultRanking, BaseRankingModel
+
+from rank_cache import RankCache, settings_fingerprint, GARBAGE
+from prefilter import TitlePrefilter, RANK_PREFILTER
+
+# Profile ranked when none is given, the name settings.py gives settings.json.
+# Defined here rather than in settings.py, which ranking worker processes
+# don't import
+STANDARD_PROFILE = "standard"
+
+# Worker processes parsing titles, 0 ranks everything in the calling thread
+# (the default on single-core hosts, where a pool only adds IPC)
+_cpus = os.cpu_count() or 1
+RANKING_PROCESSES = int(os.getenv("RANKING_PROCESSES", str(min(4, _cpus) if _cpus > 1 else 0)))
+# Titles sent to a worker process per task
+RANKING_BATCH_SIZE = int(os.getenv("RANKING_BATCH_SIZE", "50"))
+# Smaller rankings stay in-process, where they are cheaper than the IPC round trip
+RANKING_POOL_THRESHOLD = int(os.getenv("RANKING_POOL_THRESHOLD", "40"))
+
+
+class RankResult(NamedTuple):
+    """The parts of an RTN Torrent the pipelines use, cheap to send between processes."""
+    info_hash: str
+    title: str  # Parsed title
+    rank: int
+    fetch: bool
+
+
+class ProfileRanks(NamedTuple):
+    """One parsed title scored against every ranking profile: profile name -> (rank, fetch)."""
+    info_hash: str
+    title: str  # Parsed title
+    scores: Dict[str, Tuple[int, bool]]
+
+
+# Profiles and ranking model of a ranking worker process, built once by _init_worker
+_profiles: Dict[str, SettingsModel] = {}
+_ranking_model: Optional[BaseRankingModel] = None
+
+
+def _init_worker(profiles_data: Dict[str, Dict[str, Any]]) -> None:
+    global _profiles, _ranking_model
+    _profiles = {name: SettingsModel(**data) for name, data in profiles_data.items()}
+    _ranking_model = DefaultRanking()
+
+
+def rank_batch(items: List[Tuple[str, str]], profiles: Optional[Dict[str, SettingsModel]] = None,
+               ranking_model: Optional[BaseRankingModel] = None) -> List[Optional[ProfileRanks]]:
+    """
+    Parse each (title, info_hash) pair once and score it against every
+    profile, the same way RTN.rank() does for one. Returns None for garbage
+    (anything but a SHA-1 infohash, which RTN.rank() rejects).
+    """
+    profiles = profiles or _profiles
+    ranking_model = ranking_model or _ranking_model
+    results = []
+    for title, info_hash in items:
+        if len(info_hash) != 40:
+            results.append(None)
+            continue
+        data = parse(title)
+        scores = {
+            name: (get_rank(data, settings, ranking_model), check_fetch(data, settings))
+            for name, settings in profiles.items()
+        }
+        results.append(ProfileRanks(info_hash, data.parsed_title, scores))
+    return results
+
+
+class RankingService:
+    """
+    Rank torrent titles on a pool of worker processes, so parsing the titles
+    of many requests at once scales with cores instead of serializing on the
+    GIL. Each worker loads the RTN settings once when it starts. Requests
+    below the pool threshold, or any request when the pool is disabled or
+    broken, are ranked in the calling thread.
+
+    Every title is parsed once and scored against all ranking profiles,
+    and the scores of every profile are cached, so a 4K request after a
+    standard one for the same listing parses nothing. Titles seen before
+    under the same settings fingerprint are served from the rank cache, and
+    with RANK_PREFILTER on, uncached titles the profile's pre-filter rejects
+    never reach RTN.
+    """
+
+    def __init__(self, processes: int = RANKING_PROCESSES, batch_size: int = RANKING_BATCH_SIZE,
+                 threshold: int = RANKING_POOL_THRESHOLD, use_prefilter: bool = RANK_PREFILTER):
+        self.processes = processes
+        self.batch_size = max(1, batch_size)
+        self.threshold = threshold
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.cache = RankCache()
+        self._fingerprint: Optional[str] = None
+        self.use_prefilter = use_prefilter
+        self.prefilters: Dict[str, TitlePrefilter] = {}
+
+    @property
+    def fingerprint(self) -> str:
+        if self._fingerprint is None:
+            from settings import profiles_data, rtn
+            with self._lock:
+                if self._fingerprint is None:
+                    fingerprint = settings_fingerprint(profiles_data, rtn.ranking_model)
+                    self.cache.purge_stale(fingerprint)
+                    self._fingerprint = fingerprint
+        return self._fingerprint
+
+    @property
+    def profiles(self) -> Dict[str, SettingsModel]:
+        from settings import profile_settings
+        return profile_settings
+
+    def prefilter(self, profile: str) -> Optional[TitlePrefilter]:
+        if self.use_prefilter and profile not in self.prefilters:
+            self.prefilters[profile] = TitlePrefilter(self.profiles[profile])
+        return self.prefilters.get(profile)
+
+    def _cache_key(self, profile: str) -> str:
+        # Rankings are cached per profile under the fingerprint of all profiles
+        return f"{self.fingerprint}:{profile}"
+
+    def _get_pool(self) -> Optional[ProcessPoolExecutor]:
+        if self.processes <= 0:
+            return None
+        with self._lock:
+            if self._pool is None:
+                from settings import profiles_data
+                try:
+                    # Spawned workers don't inherit the locks of this threaded process
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.processes,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_init_worker,
+                        initargs=(profiles_data,)
+                    )
+                except (OSError, NotImplementedError, ImportError) as e:
+                    # No working sem_open, as on serverless runtimes: rank in-process from now on
+                    logger.warning(f"Can't start the ranking pool ({e!r}), ranking in-process")
+                    self.processes = 0
+                    return None
+                logger.info(f"Started ranking pool with {self.processes} processes")
+            return self._pool
+
+    def _batches(self, items: List[Tuple[str, str]]) -> List[List[Tuple[str, str]]]:
+        return [items[start:start + self.batch_size] for start in range(0, len(items), self.batch_size)]
+
+    def _rank_locally(self, items: List[Tuple[str, str]]) -> List[Optional[ProfileRanks]]:
+        from settings import rtn
+        return rank_batch(items, self.profiles, rtn.ranking_model)
+
+    def _reset_pool(self, error: Exception) -> None:
+        logger.error(f"Ranking pool failed ({error!r}), ranking in-process until it restarts")
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def rank(self, items: List[Tuple[str, str]], profile: str = STANDARD_PROFILE) -> List[Optional[RankResult]]:
+        """
+        Rank (title, info_hash) pairs under a profile, results in input order.
+        Rejected titles rank as None.
+        """
+        self._check_profile(profile)
+        found, missing = self.cache.get_many(self._cache_key(profile), items)
+        missing = self._prefiltered(missing, profile, found)
+        if missing:
+            found.update(self._remember(missing, self._rank_uncached(missing), profile))
+        return [self._result(item, found[item]) for item in items]
+
+    async def rank_async(self, items: List[Tuple[str, str]], profile: str = STANDARD_PROFILE) -> List[Optional[RankResult]]:
+        """Like rank(), without blocking the event loop on pool results."""
+        self._check_profile(profile)
+        found, missing = self.cache.get_many(self._cache_key(profile), items)
+        missing = self._prefiltered(missing, profile, found)
+        if missing:
+            found.update(self._remember(missing, await self._rank_uncached_async(missing), profile))
+        return [self._result(item, found[item]) for item in items]
+
+    def _check_profile(self, profile: str) -> None:
+        if profile not in self.profiles:
+            raise ValueError(f"Unknown ranking profile: {profile}")
+
+    def _prefiltered(self, items: List[Tuple[str, str]], profile: str,
+                     found: Dict[Tuple[str, str], Any]) -> List[Tuple[str, str]]:
+        """
+        The cache misses the profile's pre-filter accepts. Rejected titles are
+        cached as garbage under the profile, so a cached title never costs a
+        regex pass.
+        """
+        prefilter = self.prefilter(profile)
+        if prefilter is None or not items:
+            return items
+        verdicts = prefilter.filter([title for title, _ in items])
+        rejected = {item: GARBAGE for item, ok in zip(items, verdicts) if not ok}
+        if rejected:
+            self.cache.put_many(self._cache_key(profile), rejected)
+            found.update(rejected)
+        return [item for item, ok in zip(items, verdicts) if ok]
+
+    def _remember(self, items: List[Tuple[str, str]], results: List[Optional[ProfileRanks]],
+                  profile: str) -> Dict[Tuple[str, str], Any]:
+        """Cache the scores of every profile, returning the values of the requested one."""
+        for name in self.profiles:
+            values = {
+                item: GARBAGE if result is None else (result.title, *result.scores[name])
+                for item, result in zip(items, results)
+            }
+            self.cache.put_many(self._cache_key(name), values)
+            if name == profile:
+                requested = values
+        return requested
+
+    @staticmethod
+    def _result(item: Tuple[str, str], value: Any) -> Optional[RankResult]:
+        return None if value is GARBAGE else RankResult(item[1], *value)
+
+    def _rank_uncached(self, items: List[Tuple[str, str]]) -> List[Optional[ProfileRanks]]:
+        if len(items) < self.threshold:
+            return self._rank_locally(items)
+        try:
+            pool = self._get_pool()
+            if pool is None:
+                return self._rank_locally(items)
+            futures = [pool.submit(rank_batch, batch) for batch in self._batches(items)]
+            return [result for future in futures for result in future.result()]
+        except (BrokenProcessPool, OSError, RuntimeError) as e:
+            # RuntimeError: the pool was shut down by a concurrent reset
+            self._reset_pool(e)
+            return self._rank_locally(items)
+
+    async def _rank_uncached_async(self, items: List[Tuple[str, str]]) -> List[Optional[ProfileRanks]]:
+        # In-process ranking runs on a thread so a large listing doesn't stall the event loop
+        if len(items) < self.threshold:
+            return await asyncio.to_thread(self._rank_locally, items)
+        try:
+            pool = self._get_pool()
+            if pool is None:
+                return await asyncio.to_thread(self._rank_locally, items)
+            batches = await asyncio.gather(*(
+                asyncio.wrap_future(pool.submit(rank_batch, batch)) for batch in self._batches(items)
+            ))
+            return [result for batch in batches for result in batch]
+        except (BrokenProcessPool, OSError, RuntimeError) as e:
+            self._reset_pool(e)
+            return await asyncio.to_thread(self._rank_locally, items)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+
+ranking_service = RankingService()
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, Iterator, List
+from urllib.parse import urlparse
+
+from loguru import logger
+
+# Sustained requests per minute and burst size for each upstream
+RD_RATE_LIMIT = int(os.getenv("RD_RATE_LIMIT", "60"))
+TORRENTIO_RATE_LIMIT = int(os.getenv("TORRENTIO_RATE_LIMIT", "60"))
+TRAKT_RATE_LIMIT = int(os.getenv("TRAKT_RATE_LIMIT", "200"))
+OVERSEERR_RATE_LIMIT = int(os.getenv("OVERSEERR_RATE_LIMIT", "600"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "5"))
+
+# Fallback pause after a 429 without a usable Retry-After header
+DEFAULT_RETRY_AFTER = 60
+
+_wait_tracker: ContextVar[Optional[List[float]]] = ContextVar("rate_limit_wait", default=None)
+
+
+@contextmanager
+def track_wait() -> Iterator[List[float]]:
+    """
+    Accumulate the time the current thread or task (and tasks it spawns)
+    spends waiting on any governor. The yielded list holds the total in
+    seconds at index 0.
+    """
+    tracker = [0.0]
+    token = _wait_tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _wait_tracker.reset(token)
+
+
+class RateGovernor:
+    """
+    GCRA (generic cell rate algorithm) limiter for one upstream host, shared
+    by every thread and coroutine in the process. Requests are spaced evenly
+    at rate_per_minute with up to `burst` sent back to back, and a 429 blocks
+    the host for its Retry-After.
+    """
+
+    def __init__(self, name: str, rate_per_minute: int, burst: int = RATE_LIMIT_BURST):
+        self.name = name
+        self.interval = 60.0 / rate_per_minute
+        self.tolerance = self.interval * (max(burst, 1) - 1)
+        self._tat = 0.0  # Theoretical arrival time of the next request
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+
+    def reserve(self) -> float:
+        """Reserve a slot for one request and return how long to wait before sending it."""
+        with self._lock:
+            now = time.monotonic()
+            tat = max(self._tat, now, self._blocked_until)
+            wait = max(0.0, tat - self.tolerance - now, self._blocked_until - now)
+            self._tat = tat + self.interval
+            self.requests += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.last_wait = wait
+        tracker = _wait_tracker.get()
+        if tracker is not None:
+            tracker[0] += wait
+        if wait > 1:
+            logger.debug(f"Rate governor {self.name}: waiting {wait:.1f}s")
+        return wait
+
+    def acquire(self) -> float:
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self) -> float:
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def penalize(self, retry_after: Optional[float]) -> float:
+        """Block the host after a 429 and return the pause applied."""
+        pause = retry_after if retry_after is not None else DEFAULT_RETRY_AFTER
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + pause)
+            self.throttled += 1
+        logger.warning(f"Rate governor {self.name}: 429 received, pausing for {pause:.0f}s")
+        return pause
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "rate_per_minute": round(60.0 / self.interval, 2),
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "total_wait_seconds": round(self.total_wait, 3),
+                "max_wait_seconds": round(self.max_wait, 3),
+                "last_wait_seconds": round(self.last_wait, 3),
+                "blocked_for_seconds": round(max(0.0, self._blocked_until - time.monotonic()), 3)
+            }
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given either as seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+governors = {
+    "real-debrid": RateGovernor("real-debrid", RD_RATE_LIMIT),
+    "torrentio": RateGovernor("torrentio", TORRENTIO_RATE_LIMIT),
+    "trakt": RateGovernor("trakt", TRAKT_RATE_LIMIT),
+    "overseerr": RateGovernor("overseerr", OVERSEERR_RATE_LIMIT)
+}
+
+_hosts = {
+    "api.real-debrid.com": "real-debrid",
+    "torrentio.strem.fun": "torrentio",
+    "api.trakt.tv": "trakt"
+}
+
+
+def governor_for_url(url: str) -> RateGovernor:
+    """Governor for the host of url; any host not listed is treated as Overseerr."""
+    host = urlparse(url).hostname or ""
+    return governors[_hosts.get(host, "overseerr")]
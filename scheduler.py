@@ -0,0 +1,85 @@
+import os
+import threading
+import time
+from typing import Callable, Optional, Dict, Any
+
+from loguru import logger
+
+# Minutes between two Overseerr syncs
+SYNC_INTERVAL_MINUTES = float(os.getenv("SYNC_INTERVAL_MINUTES", "15"))
+
+
+class SyncScheduler:
+    """
+    Run a sync function in a background thread every `interval` seconds,
+    starting immediately. The loop never blocks the caller of start(), and
+    trigger() brings the next run forward.
+    """
+
+    def __init__(self, sync: Callable[[], int], interval: float):
+        self.sync = sync
+        self.interval = interval
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.running = False
+        self.next_run_at: Optional[float] = None
+        self.last_run_started_at: Optional[float] = None
+        self.last_run_duration: Optional[float] = None
+        self.last_run_enqueued: Optional[int] = None
+        self.last_error: Optional[str] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self.next_run_at = time.time()
+        self._thread = threading.Thread(target=self._loop, name="sync-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"Sync scheduler started, polling Overseerr every {self.interval:.0f}s")
+
+    def stop(self, timeout: float = 5) -> None:
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join(timeout)
+        self._thread = None
+        self.next_run_at = None
+
+    def trigger(self) -> None:
+        self._wakeup.set()
+
+    def _loop(self) -> None:
+        while not self._stopping.is_set():
+            self._run_once()
+            self.next_run_at = time.time() + self.interval
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def _run_once(self) -> None:
+        self.running = True
+        self.last_run_started_at = time.time()
+        start = time.perf_counter()
+        try:
+            self.last_run_enqueued = self.sync()
+            self.last_error = None
+        except Exception as e:
+            logger.error(f"Overseerr sync failed: {e}")
+            self.last_error = str(e)
+        finally:
+            self.last_run_duration = round(time.perf_counter() - start, 3)
+            self.running = False
+        logger.info(f"Overseerr sync finished in {self.last_run_duration}s, queued {self.last_run_enqueued} requests")
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "enabled": self._thread is not None,
+            "running": self.running,
+            "interval_seconds": self.interval,
+            "next_run_at": self.next_run_at,
+            "last_run_started_at": self.last_run_started_at,
+            "last_run_duration_seconds": self.last_run_duration,
+            "last_run_enqueued": self.last_run_enqueued,
+            "last_error": self.last_error
+        }
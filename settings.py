@@ -1,9 +1,12 @@
 import os
 import json
+from typing import Dict, Any
 from dotenv import load_dotenv
 from RTN import RTN
 from RTN.models import SettingsModel, DefaultRanking
 
+from ranking import STANDARD_PROFILE
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -17,8 +20,35 @@ settings = SettingsModel(**settings_data)
 # Initialize RTN with the settings
 rtn = RTN(settings=settings, ranking_model=DefaultRanking())
 
+# Named ranking profiles: settings.json is the standard profile, and each
+# entry of the profiles file is settings.json with that entry's fields
+# replaced
+RANKING_PROFILES_FILE = os.getenv("RANKING_PROFILES_FILE", "profiles.json")
+# Comma-separated profiles to rank against, all of them when unset
+RANKING_PROFILES = [name.strip() for name in os.getenv("RANKING_PROFILES", "").split(",") if name.strip()]
+# Profile serving 4K requests
+PROFILE_4K = os.getenv("PROFILE_4K", "4k")
+
+profiles_data: Dict[str, Dict[str, Any]] = {STANDARD_PROFILE: {**settings_data, "profile": STANDARD_PROFILE}}
+if os.path.exists(RANKING_PROFILES_FILE):
+    with open(RANKING_PROFILES_FILE, 'r') as file:
+        for name, overrides in json.load(file).items():
+            if not RANKING_PROFILES or name in RANKING_PROFILES:
+                profiles_data[name] = {**settings_data, **overrides, "profile": name}
+
+# Settings of every active profile, all scored from one parse of each title
+profile_settings: Dict[str, SettingsModel] = {name: SettingsModel(**data) for name, data in profiles_data.items()}
+
+
+# Function to pick the ranking profile of a request
+def profile_for(is4k: bool) -> str:
+    if is4k and PROFILE_4K in profile_settings:
+        return PROFILE_4K
+    return STANDARD_PROFILE
+
 # Verify the settings and RTN instance
 print("Settings loaded successfully:")
 print(settings)
 print("\nRTN instance initialized successfully:")
-print(rtn)
\ No newline at end of file
+print(rtn)
+print(f"\nRanking profiles: {', '.join(profile_settings)}")
\ No newline at end of file
@@ -0,0 +1,137 @@
+import re
+from typing import List, Dict, Any, Optional, NamedTuple, Sequence
+
+import numpy as np
+
+# Torrentio puts the stats on one line of the title:
+# "👤 123 💾 4.5 GB ⚙️ ThePirateBay"
+_SEEDERS = re.compile(r"👤\s*(\d+)")
+_SIZE = re.compile(r"💾\s*([\d.,]+)\s*([KMGT]?B)", re.IGNORECASE)
+_SOURCE = re.compile(r"⚙\ufe0f?\s*(.+?)\s*$")
+_STATS_MARKERS = ("👤", "💾", "⚙")
+
+_UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "TB": 1024 ** 4}
+
+
+class StreamRecord(NamedTuple):
+    """The fields of one Torrentio stream the pipelines use."""
+    name: str  # Release name, the first title line
+    title: str  # Release and file name lines, without the stats line
+    info_hash: str
+    file_idx: int
+    size: int  # Bytes, 0 if unknown
+    seeders: int  # -1 if unknown
+    source: str
+
+
+def parse_stream(stream: Dict[str, Any]) -> Optional[StreamRecord]:
+    """Split a Torrentio stream into a StreamRecord, or None without a title or infoHash."""
+    info_hash = (stream.get('infoHash') or '').lower()
+    raw_title = stream.get('title')
+    if not info_hash or not raw_title:
+        return None
+
+    lines = [line.strip() for line in raw_title.splitlines() if line.strip()]
+    stats = next((line for line in lines if any(marker in line for marker in _STATS_MARKERS)), "")
+    title_lines = [line for line in lines if line is not stats] or lines
+
+    seeders = _SEEDERS.search(stats)
+    size = _SIZE.search(stats)
+    source = _SOURCE.search(stats)
+    size_bytes = 0
+    if size:
+        try:
+            size_bytes = int(float(size.group(1).replace(",", "")) * _UNITS.get(size.group(2).upper(), 1))
+        except ValueError:
+            pass
+
+    return StreamRecord(
+        name=title_lines[0],
+        title="\n".join(title_lines),
+        info_hash=info_hash,
+        file_idx=stream.get('fileIdx') or 0,
+        size=size_bytes,
+        seeders=int(seeders.group(1)) if seeders else -1,
+        source=source.group(1) if source else ""
+    )
+
+
+class CandidateTable:
+    """
+    Column-oriented table of the streams of one Torrentio response, one row
+    per infoHash in Torrentio order. Numeric columns are NumPy arrays and row
+    sets are arrays of row indices, so filters are boolean masks and top-k
+    is one lexsort instead of per-row Python loops. rank and fetch are
+    filled in by set_ranks().
+    """
+
+    def __init__(self, records: Sequence[StreamRecord]):
+        self.names = [record.name for record in records]
+        self.titles = [record.title for record in records]
+        self.info_hashes = [record.info_hash for record in records]
+        self.sources = [record.source for record in records]
+        self.file_idx = np.fromiter((record.file_idx for record in records), dtype=np.int64, count=len(records))
+        self.size = np.fromiter((record.size for record in records), dtype=np.int64, count=len(records))
+        self.seeders = np.fromiter((record.seeders for record in records), dtype=np.int64, count=len(records))
+        self.rank = np.zeros(len(records), dtype=np.int64)
+        self.fetch = np.zeros(len(records), dtype=bool)
+        self.parsed_titles: List[Optional[str]] = [None] * len(records)
+
+    @classmethod
+    def from_streams(cls, streams: List[Dict[str, Any]]) -> "CandidateTable":
+        seen = set()
+        records = []
+        for stream in streams:
+            record = parse_stream(stream)
+            if record is None or record.info_hash in seen:
+                continue
+            seen.add(record.info_hash)
+            records.append(record)
+        return cls(records)
+
+    def __len__(self) -> int:
+        return len(self.info_hashes)
+
+    def set_ranks(self, results: List[Any], rows: Optional[Sequence[int]] = None) -> None:
+        """Store RankResults (None for garbage) for the given rows, all rows by default."""
+        rows = self.rows() if rows is None else rows
+        ranked = [(row, result) for row, result in zip(rows, results) if result is not None]
+        if not ranked:
+            return
+        indices = np.fromiter((row for row, _ in ranked), dtype=np.intp, count=len(ranked))
+        self.rank[indices] = [result.rank for _, result in ranked]
+        self.fetch[indices] = [result.fetch for _, result in ranked]
+        for row, result in ranked:
+            self.parsed_titles[row] = result.title
+
+    def rows(self) -> np.ndarray:
+        return np.arange(len(self), dtype=np.intp)
+
+    def where(self, mask: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Rows (all, or a subset) whose mask entry is true; mask is indexed by row."""
+        if rows is None:
+            return np.flatnonzero(mask)
+        rows = np.asarray(rows, dtype=np.intp)
+        return rows[mask[rows]]
+
+    def fetchable(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        return self.where(self.fetch, rows)
+
+    def within(self, min_seeders: int = 0, max_size: int = 0, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Rows with at least min_seeders seeders and at most max_size bytes.
+        Unknown values always pass, and a 0 bound is no bound.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if min_seeders > 0:
+            mask &= (self.seeders < 0) | (self.seeders >= min_seeders)
+        if max_size > 0:
+            mask &= self.size <= max_size
+        return self.where(mask, rows)
+
+    def top_k(self, k: int, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """The k best rows by rank, then seeders, best first; ties keep Torrentio order."""
+        rows = self.rows() if rows is None else np.asarray(rows, dtype=np.intp)
+        # lexsort sorts by its last key first, ascending
+        order = np.lexsort((rows, -self.seeders[rows], -self.rank[rows]))
+        return rows[order[:k]]
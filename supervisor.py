@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+from queue import Empty
+from typing import Callable, Optional, Dict, Any, List
+
+from loguru import logger
+
+# Seconds a shutdown waits for running jobs before abandoning them to redelivery
+WORKER_SHUTDOWN_TIMEOUT = float(os.getenv("WORKER_SHUTDOWN_TIMEOUT", "25"))
+
+# Seconds a worker blocks on the queue or limiter before rechecking pause/stop
+POLL_INTERVAL = 1.0
+
+
+class WorkerState:
+    """What one worker thread is doing right now."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "starting"  # starting, idle, busy, paused, stopped
+        self.job_id: Optional[str] = None
+        self.since = time.time()
+        self.processed = 0
+
+    def set(self, state: str, job_id: Optional[str] = None) -> None:
+        self.state = state
+        self.job_id = job_id
+        self.since = time.time()
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "state": self.state,
+            "job_id": self.job_id,
+            "since": self.since,
+            "processed": self.processed
+        }
+
+
+class WorkerSupervisor:
+    """
+    Own the worker threads draining the job queue. Workers can be paused and
+    resumed, in which case they finish the job in hand and take no new one,
+    and drain() stops them gracefully: no new jobs are taken and running ones
+    get until the deadline to finish. A job still running at the deadline
+    keeps its queue lease and is redelivered, from its last checkpoint, to
+    the next process.
+    """
+
+    def __init__(self, queue, limiter, handle: Callable[[Any], None], size: int):
+        self.queue = queue
+        self.limiter = limiter
+        self.handle = handle
+        self.size = size
+        self.workers: List[WorkerState] = []
+        self._threads: List[threading.Thread] = []
+        self._running = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            self._running.set()
+            for number in range(self.size):
+                state = WorkerState(f"worker-{number}")
+                thread = threading.Thread(target=self._work, args=(state,), name=state.name, daemon=True)
+                self.workers.append(state)
+                self._threads.append(thread)
+                thread.start()
+        logger.info(f"Started {self.size} queue workers")
+
+    def pause(self) -> None:
+        self._running.clear()
+        logger.info("Queue workers paused")
+
+    def resume(self) -> None:
+        self._running.set()
+        logger.info("Queue workers resumed")
+
+    def drain(self, timeout: float = WORKER_SHUTDOWN_TIMEOUT) -> bool:
+        """Stop the workers, waiting up to timeout seconds for running jobs. Returns True if all finished."""
+        with self._lock:
+            threads = list(self._threads)
+        if not threads:
+            return True
+        busy = sum(1 for worker in self.workers if worker.state == "busy")
+        logger.info(f"Draining queue workers, waiting up to {timeout:.0f}s for {busy} running jobs")
+        self._stopping.set()
+        self._running.set()  # Let paused workers see the stop
+        deadline = time.monotonic() + timeout
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+        abandoned = [worker for worker in self.workers if worker.state == "busy"]
+        for worker in abandoned:
+            logger.warning(f"Shutdown deadline reached, {worker.name} abandons job {worker.job_id} for redelivery")
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            if not self._threads:
+                self.workers = []
+        if not abandoned:
+            logger.info("Queue workers drained")
+        return not abandoned
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "paused": not self._running.is_set(),
+            "draining": self._stopping.is_set(),
+            "workers": [worker.as_dict() for worker in self.workers]
+        }
+
+    def _work(self, state: WorkerState) -> None:
+        while not self._stopping.is_set():
+            if not self._running.is_set():
+                state.set("paused")
+                self._running.wait()
+                continue
+            state.set("idle")
+
+            # Take a concurrency permit before dequeuing, so jobs that cannot
+            # run yet stay in priority order on the queue
+            if not self.limiter.acquire(timeout=POLL_INTERVAL):
+                continue
+            try:
+                if self._stopping.is_set() or not self._running.is_set():
+                    continue
+                try:
+                    entry = self.queue.get(timeout=POLL_INTERVAL)
+                except Empty:
+                    continue
+                if entry is None:
+                    break
+                state.set("busy", entry.id)
+                try:
+                    self.handle(entry)
+                finally:
+                    state.processed += 1
+            except Exception as e:
+                logger.error(f"{state.name} failed: {e}")
+            finally:
+                self.limiter.release()
+        state.set("stopped")
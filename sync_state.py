@@ -0,0 +1,24 @@
+import time
+from typing import Optional
+
+from db import register_schema, get_connection
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS sync_state (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+""")
+
+
+def get_state(name: str) -> Optional[str]:
+    row = get_connection().execute("SELECT value FROM sync_state WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def set_state(name: str, value: str) -> None:
+    get_connection().execute(
+        "INSERT OR REPLACE INTO sync_state (name, value, updated_at) VALUES (?, ?, ?)",
+        (name, value, time.time())
+    )
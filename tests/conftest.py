@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Point db at a fresh SQLite file for the test, with a new per-thread connection."""
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "test.db"))
+    monkeypatch.setattr(db, "_local", db.threading.local())
+    yield db.get_connection()
+    db.get_connection().close()
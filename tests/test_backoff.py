@@ -0,0 +1,120 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import backoff
+from media_keys import pipeline_key
+
+HOUR = 3600
+
+
+class Clock:
+    """Wall clock backoff reads, advanced by hand."""
+
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(backoff, "time", SimpleNamespace(time=clock, monotonic=time.monotonic))
+    monkeypatch.setattr(backoff, "NEGATIVE_BACKOFF_BASE_MINUTES", 60)
+    monkeypatch.setattr(backoff, "NEGATIVE_BACKOFF_MAX_HOURS", 72)
+    monkeypatch.setattr(backoff, "NEGATIVE_BACKOFF_JITTER", 0)
+    return clock
+
+
+def make_request(tmdb_id=1, seasons=(), is4k=False, request_id=None):
+    return {
+        "id": request_id,
+        "media": {"tmdbId": tmdb_id, "mediaType": "tv" if seasons else "movie"},
+        "seasons": [{"seasonNumber": season} for season in seasons],
+        "is4k": is4k
+    }
+
+
+def test_backed_off_until_the_latest_retry(database, clock):
+    request = make_request()
+    key = pipeline_key(request)
+    assert backoff.backed_off(key) is None
+
+    backoff.record_failure(key, "no_torrents", request)
+    backoff.record_failure(key, "no_candidates", request)
+    # The pending backoff reported is the one that ends last
+    assert backoff.backed_off(key) == {"reason": "no_candidates", "failures": 1, "retry_at": clock.now + 2 * HOUR}
+
+    clock.advance(HOUR + 1)
+    assert backoff.backed_off(key)["reason"] == "no_candidates"
+    clock.advance(HOUR)
+    assert backoff.backed_off(key) is None
+
+
+def test_backoff_doubles_per_failure_and_is_kept_per_key(database, clock):
+    request = make_request(seasons=(1, 2))
+    key = pipeline_key(request)
+    backoff.record_failure(key, "no_torrents", request)
+    backoff.record_failure(key, "no_torrents", request)
+    assert backoff.backed_off(key) == {"reason": "no_torrents", "failures": 2, "retry_at": clock.now + 2 * HOUR}
+
+    # Other seasons and the 4K version of the same title are separate keys
+    assert backoff.backed_off(pipeline_key(make_request(seasons=(1,)))) is None
+    assert backoff.backed_off(pipeline_key(make_request(seasons=(1, 2), is4k=True))) is None
+
+    backoff.update(key, True, None)
+    assert backoff.backed_off(key) is None
+
+
+def test_due_requests_waits_for_every_reason_and_returns_the_latest_request(database, clock):
+    first = make_request(request_id=1)
+    latest = make_request(request_id=2)
+    key = pipeline_key(first)
+    backoff.record_failure(key, "no_candidates", first)
+    clock.advance(1)
+    backoff.record_failure(key, "no_torrents", latest)
+    assert backoff.due_requests() == []
+
+    # no_torrents expired, no_candidates hasn't
+    clock.advance(HOUR + 1)
+    assert backoff.due_requests() == []
+
+    clock.advance(HOUR)
+    assert backoff.due_requests() == [latest]
+
+
+def test_due_request_is_claimed_until_its_next_backoff_step(database, clock):
+    request = make_request()
+    key = pipeline_key(request)
+    backoff.record_failure(key, "no_torrents", request)
+    clock.advance(HOUR + 1)
+
+    assert backoff.due_requests() == [request]
+    # The retry is in flight or ended without a recorded reason
+    backoff.update(key, False, None, request)
+    assert backoff.due_requests() == []
+    assert backoff.backed_off(key) is not None
+
+    clock.advance(2 * HOUR + 1)
+    assert backoff.due_requests() == [request]
+
+
+def test_recorded_failure_replaces_the_claim(database, clock):
+    request = make_request()
+    key = pipeline_key(request)
+    backoff.record_failure(key, "no_torrents", request)
+    clock.advance(HOUR + 1)
+    assert backoff.due_requests() == [request]
+
+    backoff.update(key, False, "no_torrents", request)
+    assert backoff.backed_off(key) == {"reason": "no_torrents", "failures": 2, "retry_at": clock.now + 2 * HOUR}
+
+    backoff.update(key, True, None)
+    clock.advance(72 * HOUR)
+    assert backoff.due_requests() == []
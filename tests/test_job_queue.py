@@ -0,0 +1,126 @@
+import time
+from queue import Empty
+from types import SimpleNamespace
+
+import pytest
+
+import job_queue
+from job_queue import DurableJobQueue, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+
+
+class Clock:
+    """Wall clock the queue reads for leases and aging, advanced by hand."""
+
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(job_queue, "time", SimpleNamespace(time=clock, monotonic=time.monotonic))
+    return clock
+
+
+def drain(queue):
+    ids = []
+    while True:
+        try:
+            job = queue.get(timeout=0)
+        except Empty:
+            return ids
+        ids.append(job.id)
+        queue.ack(job.id)
+
+
+def test_expired_lease_is_redelivered_with_checkpoint(database, clock):
+    queue = DurableJobQueue(visibility_timeout=60)
+    queue.put("job", "webhook", {"media_id": 1})
+
+    job = queue.get(timeout=0)
+    assert job.deliveries == 1
+    queue.checkpoint("job", {"stage": "ranked"})
+    with pytest.raises(Empty):
+        queue.get(timeout=0)
+
+    # A checkpoint extends the lease from the time it was saved
+    clock.advance(59)
+    with pytest.raises(Empty):
+        queue.get(timeout=0)
+
+    clock.advance(2)
+    job = queue.get(timeout=0)
+    assert job.id == "job"
+    assert job.deliveries == 2
+    assert job.checkpoint == {"stage": "ranked"}
+    assert job.request == {"media_id": 1}
+
+
+def test_job_is_dropped_after_max_deliveries(database, clock):
+    queue = DurableJobQueue(visibility_timeout=60, max_deliveries=2)
+    queue.put("stuck", "sync", {})
+    queue.put("later", "sync", {})
+
+    assert queue.get(timeout=0).id == "stuck"
+    clock.advance(61)
+    assert queue.get(timeout=0).deliveries == 2
+    clock.advance(61)
+
+    # The third delivery is refused: the job is deleted and the next one served
+    assert queue.get(timeout=0).id == "later"
+    assert [job.id for job in queue.recover()] == ["later"]
+
+
+def test_recover_releases_leases_of_other_owners(database, clock):
+    crashed = DurableJobQueue(visibility_timeout=600)
+    crashed.put("interrupted", "webhook", {})
+    crashed.put("pending", "webhook", {})
+    assert crashed.get(timeout=0).id == "interrupted"
+
+    restarted = DurableJobQueue(visibility_timeout=600)
+    assert restarted.get(timeout=0).id == "pending"
+    with pytest.raises(Empty):
+        restarted.get(timeout=0)
+
+    recovered = restarted.recover()
+    assert [job.id for job in recovered] == ["interrupted", "pending"]
+    # Without waiting out the crashed owner's lease; the restarted owner's own lease is kept
+    job = restarted.get(timeout=0)
+    assert job.id == "interrupted"
+    assert job.deliveries == 2
+    with pytest.raises(Empty):
+        restarted.get(timeout=0)
+
+
+def test_priority_order_with_aging(database, clock):
+    queue = DurableJobQueue(aging_rate=10)
+    queue.put("backlog", "sync", {}, priority=PRIORITY_LOW)
+    clock.advance(3 * 60)
+    queue.put("approved", "sync", {}, priority=PRIORITY_NORMAL)
+    queue.put("webhook", "webhook", {}, priority=PRIORITY_HIGH)
+    queue.put("webhook_2", "webhook", {}, priority=PRIORITY_HIGH)
+
+    # Priority first, FIFO among equals
+    assert drain(queue) == ["webhook", "webhook_2", "approved", "backlog"]
+
+    queue.put("backlog", "sync", {}, priority=PRIORITY_LOW)
+    clock.advance(11 * 60)
+    queue.put("webhook", "webhook", {}, priority=PRIORITY_HIGH)
+
+    # 11 minutes at 10 points/min outweighs the 100 point priority gap
+    assert drain(queue) == ["backlog", "webhook"]
+
+
+def test_stop_sentinel_is_served_before_jobs(database, clock):
+    queue = DurableJobQueue()
+    queue.put("job", "webhook", {})
+    queue.put(None)
+
+    assert queue.get(timeout=0) is None
+    assert queue.get(timeout=0).id == "job"
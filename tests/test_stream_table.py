@@ -0,0 +1,54 @@
+from typing import NamedTuple
+
+from stream_table import CandidateTable, parse_stream
+
+
+class Rank(NamedTuple):
+    title: str
+    rank: int
+    fetch: bool
+
+
+def stream(info_hash, seeders=None, size="1 GB", name="Movie.2020.1080p.WEB-DL"):
+    stats = f"👤 {seeders} 💾 {size} ⚙️ YTS" if seeders is not None else f"💾 {size} ⚙️ YTS"
+    return {"title": f"{name}\n{stats}", "infoHash": info_hash * 40}
+
+
+def table_of(*streams):
+    return CandidateTable.from_streams(list(streams))
+
+
+def test_parse_stream_splits_the_stats_line():
+    record = parse_stream({"title": "Movie.2020.1080p\nMovie.mkv\n👤 12 💾 1.5 GB ⚙️ ThePirateBay",
+                           "infoHash": "A" * 40, "fileIdx": 3})
+    assert record.title == "Movie.2020.1080p\nMovie.mkv"
+    assert (record.info_hash, record.file_idx, record.seeders, record.size, record.source) == \
+        ("a" * 40, 3, 12, int(1.5 * 1024 ** 3), "ThePirateBay")
+
+
+def test_from_streams_keeps_the_first_stream_per_info_hash():
+    table = table_of(stream("a", 1), stream("b", 2), stream("a", 3))
+    assert table.info_hashes == ["a" * 40, "b" * 40]
+    assert table.seeders.tolist() == [1, 2]
+
+
+def test_within_passes_unknown_values_and_ignores_zero_bounds():
+    table = table_of(stream("a", 1), stream("b", 20), stream("c"), stream("d", 30, "9 GB"))
+    assert table.within(10, 5 * 1024 ** 3).tolist() == [1, 2]
+    assert table.within(10, 0).tolist() == [1, 2, 3]
+    assert table.within(0, 0, [3, 0]).tolist() == [3, 0]
+
+
+def test_set_ranks_skips_garbage_and_fetchable_follows_fetch():
+    table = table_of(stream("a"), stream("b"), stream("c"))
+    table.set_ranks([Rank("A", 10, True), None], [2, 0])
+    assert table.rank.tolist() == [0, 0, 10]
+    assert table.parsed_titles == [None, None, "A"]
+    assert table.fetchable().tolist() == [2]
+
+
+def test_top_k_orders_by_rank_then_seeders_then_torrentio_order():
+    table = table_of(stream("a", 5), stream("b", 9), stream("c", 9), stream("d", 1))
+    table.set_ranks([Rank("", 100, True), Rank("", 100, True), Rank("", 100, True), Rank("", 200, True)])
+    assert table.top_k(4).tolist() == [3, 1, 2, 0]
+    assert table.top_k(2, [2, 1, 0]).tolist() == [1, 2]
@@ -6,24 +6,48 @@ from bs4 import BeautifulSoup
 import re
 import os
 import mimetypes
-from typing import Optional, List, Any, Dict, Literal
-from ratelimit import limits, sleep_and_retry
+from typing import Optional, List, Any, Dict, Literal, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import RTN
 from RTN.models import SettingsModel, CustomRank, DefaultRanking
-from RTN.exceptions import GarbageTorrent
-from queue import Queue
+from job_queue import DurableJobQueue, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
 import threading
-from settings import rtn, settings
+import time
+from settings import profile_for
+from ratelimiter import governor_for_url, parse_retry_after
+from concurrency import worker_limiter, WORKERS_MAX
+from supervisor import WorkerSupervisor
+from models import Job
+from cache import torrentio_cache, rd_availability_cache
+import ledger
+import backoff
+from media_keys import pipeline_key
+from sync_state import get_state, set_state
+from id_cache import get_cached_imdb_id, store_imdb_id
+from jobs import job_store, job_stage, start_job, finish_job, PipelineResult
+from singleflight import pipeline_flight, upstream_flight
+from candidates import (
+    collect_info_hashes, chunk_hashes, rank_streams, rank_table, RankedCandidate, StreamingSelection,
+    RANK_FIRST, RANK_FIRST_TOP_N, SELECT_STREAMING
+)
+from ranking import STANDARD_PROFILE
 
 # Constants for APIs
 REAL_DEBRID_API_BASE_URL = "https://api.real-debrid.com/rest/1.0"
-TORRENTIO_API_URL = "https://torrentio.strem.fun/qualityfilter=scr,cam/stream/movie/{imdb_id}.json"
+TORRENTIO_OPTIONS = "qualityfilter=scr,cam"
+TORRENTIO_API_URL = "https://torrentio.strem.fun/{options}/stream/{kind}/{stream_id}.json"
 RD_INSTANT_AVAILABILITY_URL = f"{REAL_DEBRID_API_BASE_URL}/torrents/instantAvailability/{{hash}}"
 RD_ADD_TORRENT_URL = f"{REAL_DEBRID_API_BASE_URL}/torrents/addMagnet"
 
-# Rate limits for Real-Debrid API
-MAX_CALLS_PER_MINUTE = 60
+# Transient upstream errors retried by the session, with exponential backoff
+MAX_RETRIES = 5
+BACKOFF_FACTOR = 1
+RETRY_STATUS_CODES = {500, 502, 503, 504}
+# Only idempotent requests are retried on a 5xx, as urllib3's Retry does: a
+# 5xx after RD accepted addMagnet must not add the torrent again. A 429 was
+# rejected before it did anything and is retried for every method.
+RETRY_METHODS = Retry.DEFAULT_ALLOWED_METHODS
 
 # Load environment variables from .env file
 load_dotenv()
@@ -32,10 +56,39 @@ load_dotenv()
 RD_API_KEY = os.getenv('RD_API_KEY')
 TRAKT_API_KEY = os.getenv('TRAKT_API_KEY')
 
-# Initialize a persistent session with retry logic
+class GovernedAdapter(HTTPAdapter):
+    """
+    Transport adapter that passes every HTTP request, including retries,
+    through the rate governor of its upstream host. 5xx responses to
+    idempotent requests are retried with backoff and a 429 pauses the host
+    for its Retry-After before the request is tried again.
+    """
+
+    def send(self, request, **kwargs):
+        governor = governor_for_url(request.url)
+        for attempt in range(MAX_RETRIES + 1):
+            governor.acquire()
+            start = time.perf_counter()
+            response = super().send(request, **kwargs)
+            worker_limiter.record(governor.name, time.perf_counter() - start, response.status_code)
+            if response.status_code == 429:
+                governor.penalize(parse_retry_after(response.headers.get('Retry-After')))
+            elif response.status_code not in RETRY_STATUS_CODES or request.method not in RETRY_METHODS:
+                return response
+            if attempt == MAX_RETRIES:
+                return response
+            if response.status_code != 429:
+                time.sleep(BACKOFF_FACTOR * (2 ** attempt))
+            response.close()
+        return response
+
+# Initialize a persistent session with retry logic. Connection errors are
+# retried by urllib3, everything that reached the upstream by GovernedAdapter
 session = requests.Session()
-retries = Retry(total=5, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-session.mount('https://', HTTPAdapter(max_retries=retries))
+retries = Retry(total=MAX_RETRIES, connect=MAX_RETRIES, read=0, status=0, backoff_factor=BACKOFF_FACTOR,
+                respect_retry_after_header=False, raise_on_status=False)
+session.mount('https://', GovernedAdapter(max_retries=retries))
+session.mount('http://', GovernedAdapter(max_retries=retries))
 
 # Set default headers for the session
 session.headers.update({
@@ -46,26 +99,87 @@ session.headers.update({
 OVERSEERR_BASE = os.getenv('OVERSEERR_BASE')
 OVERSEERR_API_BASE_URL = f"{OVERSEERR_BASE}/api/v1"
 OVERSEERR_API_KEY = os.getenv('OVERSEERR_API_KEY')
+OVERSEERR_PAGE_SIZE = int(os.getenv('OVERSEERR_PAGE_SIZE', '100'))
+OVERSEERR_INCREMENTAL_SYNC = os.getenv('OVERSEERR_INCREMENTAL_SYNC', 'y').lower() == 'y'
+OVERSEERR_WATERMARK = "overseerr_requests_updated_at"
+# Walk every approved request again this often, so requests the watermark
+# already passed are retried after a failure that set no backoff
+OVERSEERR_FULL_SYNC_HOURS = float(os.getenv('OVERSEERR_FULL_SYNC_HOURS', '24'))
+OVERSEERR_LAST_FULL_SYNC = "overseerr_last_full_sync"
 
-# Initialize the queue
-request_queue = Queue()
+# Initialize the durable queue, webhooks and retries are served before backlog work
+request_queue = DurableJobQueue()
 
-# Function to process requests from the queue
-def process_request_queue():
-    while True:
-        try:
-            request = request_queue.get()
-            if request is None:
-                break
-            process_overseerr_request(request)
-            request_queue.task_done()
-        except Exception as e:
-            logger.error(f"Error processing request: {e}")
-            request_queue.task_done()  # Ensure the queue is not blocked
-
-# Function to fetch media requests from Overseerr
-def get_overseerr_media_requests() -> list[dict]:
-    url = f"{OVERSEERR_API_BASE_URL}/request?take=1000&filter=approved&sort=added"
+# Media keys of backlog requests currently queued or in progress, so repeated
+# syncs don't queue the same title twice
+_backlog_keys = set()
+_backlog_lock = threading.Lock()
+
+# Function to process one job taken from the queue
+def process_queued_job(entry):
+    job = None
+    try:
+        job = _job_for_entry(entry)
+        job.deliveries = entry.deliveries
+        job.checkpoint = dict(entry.checkpoint)
+        start_job(job)
+        process_overseerr_request(job.request, job, force=job.force)
+    except Exception as e:
+        logger.error(f"Error processing request: {e}")
+        finish_job(job, False, str(e))
+    finally:
+        if entry.source == "backlog":
+            with _backlog_lock:
+                _backlog_keys.discard(pipeline_key(entry.request))
+        # Only a worker stopped mid-job leaves the job leased for redelivery
+        request_queue.ack(entry.id)
+
+# One thread per possible slot, the adaptive limiter decides how many run at once
+worker_supervisor = WorkerSupervisor(request_queue, worker_limiter, process_queued_job, WORKERS_MAX)
+_workers_started = False
+_workers_lock = threading.Lock()
+
+# Job record of a queued entry, recreated if it was queued by an earlier process
+def _job_for_entry(entry) -> Job:
+    job = job_store.get(entry.id)
+    if job is None:
+        job = job_store.create(entry.source, entry.request, entry.force, entry.priority,
+                               job_id=entry.id, created_at=entry.created_at)
+    return job
+
+# Start the worker threads once per process
+def start_workers():
+    global _workers_started
+    with _workers_lock:
+        if _workers_started:
+            return
+        # Pick up jobs left over by an earlier process before starting work
+        for entry in request_queue.recover():
+            _job_for_entry(entry)
+            if entry.source == "backlog":
+                with _backlog_lock:
+                    _backlog_keys.add(pipeline_key(entry.request))
+        worker_supervisor.start()
+        _workers_started = True
+
+# Queue a request for the workers, tracking it as a job
+def enqueue_request(request: dict, source: str, force: bool = False, priority: Optional[int] = None) -> Job:
+    if priority is None:
+        priority = PRIORITY_LOW if source == "backlog" else PRIORITY_HIGH
+    job = job_store.create(source, request, force, priority)
+    request_queue.put(job.id, source, request, force, priority)
+    return job
+
+# Save pipeline progress so a redelivered job resumes after its last completed stage
+def _checkpoint(job: Optional[Job], **values):
+    if job is None:
+        return
+    job.checkpoint.update(values)
+    request_queue.checkpoint(job.id, job.checkpoint)
+
+# Function to fetch one page of approved media requests from Overseerr, most recently modified first
+def fetch_overseerr_request_page(skip: int, take: int) -> Optional[dict]:
+    url = f"{OVERSEERR_API_BASE_URL}/request?take={take}&skip={skip}&filter=approved&sort=modified"
     headers = {
         "X-Api-Key": OVERSEERR_API_KEY
     }
@@ -73,102 +187,214 @@ def get_overseerr_media_requests() -> list[dict]:
     
     if response.status_code != 200:
         logger.error(f"Failed to fetch requests from Overseerr: {response.status_code}")
-        return []
+        return None
+    return response.json()
+
+# Function to stream media requests from Overseerr page by page
+def iter_overseerr_media_requests(page_size: int = OVERSEERR_PAGE_SIZE, incremental: bool = OVERSEERR_INCREMENTAL_SYNC) -> Iterator[dict]:
+    """
+    Walk the approved Overseerr requests, most recently modified first, with
+    skip/take and yield the ones still processing as each page arrives. The
+    next page is downloaded in the background while the caller consumes the
+    current one.
     
-    data = response.json()
-    if not data.get('results'):
-        return []
+    When incremental, the walk stops at the first request not modified since
+    the persisted watermark. The watermark advances to the newest updatedAt
+    seen once the walk completes, and a completed full walk records its time.
+    """
+    since = get_state(OVERSEERR_WATERMARK) if incremental else None
+    newest = since or ""
+    if since:
+        logger.info(f"Syncing Overseerr requests modified since {since}")
+    
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="overseerr-sync") as executor:
+        skip = 0
+        pending = executor.submit(fetch_overseerr_request_page, skip, page_size)
+        while pending is not None:
+            data = pending.result()
+            if data is None:
+                return  # Leave the watermark alone after a failed page
+            results = data.get('results') or []
+            page_info = data.get('pageInfo') or {}
+            skip += len(results)
+            
+            # Requests come newest first, so anything older than the watermark ends the walk
+            fresh = [item for item in results if not since or (item.get('updatedAt') or "") >= since]
+            newest = max([newest] + [item.get('updatedAt') or "" for item in fresh])
+            
+            # Prefetch the next page before handing this one out
+            more = len(fresh) == len(results) == page_size and skip < page_info.get('results', float('inf'))
+            pending = executor.submit(fetch_overseerr_request_page, skip, page_size) if more else None
+            
+            # Filter requests that are in processing state (status 3)
+            for item in fresh:
+                if item['status'] == 2 and item['media']['status'] == 3:
+                    yield item
     
-    # Filter requests that are in processing state (status 3)
-    processing_requests = [item for item in data['results'] if item['status'] == 2 and item['media']['status'] == 3]
-    return processing_requests
+    if newest and newest != since:
+        set_state(OVERSEERR_WATERMARK, newest)
+        logger.info(f"Overseerr sync watermark advanced to {newest}")
+    if not incremental:
+        set_state(OVERSEERR_LAST_FULL_SYNC, str(time.time()))
+
+# Function to fetch all media requests from Overseerr, ignoring the watermark
+def get_overseerr_media_requests() -> list[dict]:
+    return list(iter_overseerr_media_requests(incremental=False))
 
 # Function to process a single Overseerr request
-def process_overseerr_request(request: dict):
+def process_overseerr_request(request: dict, job: Optional[Job] = None, force: bool = False) -> PipelineResult:
     try:
+        key = pipeline_key(request)
         media_id = request['media']['id']
-        tmdb_id = request['media']['tmdbId']
-        media_type = request['media']['mediaType']
-        logger.info(f"Processing Overseerr request for media ID: {media_id}, tmdbId: {tmdb_id}")
-        
-        # Fetch IMDb ID using Trakt API
-        imdb_id = get_imdb_id_from_trakt(tmdb_id, media_type)  # Pass media_type here
-        if not imdb_id:
-            logger.error("IMDb ID not found")
-            return
-        
-        logger.info(f"IMDb ID found: {imdb_id}")
         
+        # Skip all upstream work for media the ledger already records as done
+        processed = None if force else ledger.get_processed(key)
+        if processed:
+            logger.info(f"Skipping {key}: already processed with torrent {processed['info_hash']}")
+            if media_id is not None and processed['media_id'] is None:
+                # Processed from a webhook, which carries no media id to mark
+                if mark_completed(media_id, bool(request.get('is4k'))):
+                    ledger.record(key, "succeeded", request.get('id'), media_id, processed['info_hash'], processed['torrent_id'], processed['message'])
+            result = PipelineResult(True, "Already processed", info_hash=processed['info_hash'], torrent_id=processed['torrent_id'])
+        else:
+            result, shared = pipeline_flight.do(key, run_overseerr_pipeline, request, job)
+            if shared:
+                logger.info(f"Shared the result of an in-flight pipeline run for {key}")
+            else:
+                ledger.record(key, "succeeded" if result.success else "failed", request.get('id'), media_id,
+                              result.info_hash, result.torrent_id, result.message)
+                backoff.update(key, result.success, result.reason, request)
+    except Exception as e:
+        logger.error(f"Error processing Overseerr request: {e}")
+        result = PipelineResult(False, str(e), 500)
+    finish_job(job, result.success, result.message)
+    return result
+
+def run_overseerr_pipeline(request: dict, job: Optional[Job] = None) -> PipelineResult:
+    media_id = request['media']['id']
+    tmdb_id = request['media']['tmdbId']
+    media_type = request['media']['mediaType']
+    is4k = bool(request.get('is4k'))
+    profile = profile_for(is4k)
+    logger.info(f"Processing Overseerr request for media ID: {media_id}, tmdbId: {tmdb_id}, ranking profile: {profile}")
+    
+    # Resume after the last stage a previous delivery of this job completed
+    checkpoint = job.checkpoint if job is not None else {}
+    if checkpoint:
+        logger.info(f"Resuming job {job.id} from checkpoint: {', '.join(checkpoint)}")
+    
+    # Resolve the IMDb ID from the payload, the ID cache or Trakt
+    imdb_id = checkpoint.get('imdb_id')
+    if not imdb_id:
+        with job_stage(job, "resolve_imdb") as stage:
+            imdb_id = resolve_imdb_id(tmdb_id, media_type, request['media'].get('imdbId'))  # Pass media_type here
+            if not imdb_id:
+                logger.error("IMDb ID not found")
+                _fail_stage(stage, "IMDb ID not found")
+                return PipelineResult(False, "IMDb ID not found", 404, reason="imdb_not_found")
+        _checkpoint(job, imdb_id=imdb_id)
+    
+    logger.info(f"IMDb ID found: {imdb_id}")
+    
+    candidate = checkpoint.get('candidate')
+    if not candidate:
         # Query Torrentio API to get torrents
-        torrentio_results = query_torrentio(imdb_id, media_type)  # Pass media_type here
-        if not torrentio_results or not torrentio_results.get('streams'):
-            logger.error("No torrents found on Torrentio")
-            return
+        with job_stage(job, "query_torrentio") as stage:
+            torrentio_results = query_torrentio(imdb_id, media_type)  # Pass media_type here
+            if not torrentio_results or not torrentio_results.get('streams'):
+                logger.error("No torrents found on Torrentio")
+                _fail_stage(stage, "No torrents found")
+                return PipelineResult(False, "No torrents found", 404, reason="no_torrents")
         
         # Check Real-Debrid availability and rank torrents
-        ranked_torrents = []
-        checked_hashes = set()
-        garbage_count = 0
-        max_hashes_to_check = 5
-        
-        for stream in torrentio_results['streams']:
-            info_hash = stream.get('infoHash')
-            title = stream.get('title')
+        with job_stage(job, "rank_candidates") as stage:
+            if SELECT_STREAMING:
+                top_candidates = select_streaming(torrentio_results['streams'], profile)
+            elif RANK_FIRST:
+                top_candidates = select_rank_first(torrentio_results['streams'], profile)
+            else:
+                top_candidates = select_rd_first(torrentio_results['streams'], profile)
             
-            if info_hash and title and info_hash not in checked_hashes:
-                checked_hashes.add(info_hash)
-                rd_availability = check_rd_availability(info_hash)
-                if rd_availability:
-                    try:
-                        torrent = rtn.rank(title, info_hash)
-                        if torrent.fetch:
-                            ranked_torrents.append(torrent)
-                        else:
-                            garbage_count += 1
-                    except GarbageTorrent:
-                        logger.info(f"Torrent {title} is marked as garbage and will be skipped.")
-                        garbage_count += 1
-                else:
-                    logger.info(f"Torrent with hash {info_hash} is not available on Real-Debrid.")
-                
-                # If we have checked 5 hashes and all are garbage, break out
-                if len(checked_hashes) >= max_hashes_to_check and garbage_count == max_hashes_to_check:
-                    logger.info("All checked torrents are garbage. No need to check more.")
-                    break
-        
-        # Sort torrents by rank in descending order
-        sorted_torrents = sorted(ranked_torrents, key=lambda x: x.rank, reverse=True)
-        
-        # Limit to the top 5 torrents
-        top_torrents = sorted_torrents[:5]
-        
-        if not top_torrents:
-            logger.error("No valid torrents found after ranking")
-            return
+            if not top_candidates:
+                logger.error("No valid torrents found after ranking")
+                _fail_stage(stage, "No valid torrents found after ranking")
+                return PipelineResult(False, "No valid torrents found after ranking", 404, reason="no_candidates")
         
         # Proceed with the top ranked torrent
-        best_torrent = top_torrents[0]
-        logger.info(f"Best torrent selected: {best_torrent.data.parsed_title} with rank {best_torrent.rank}")
-        
-        # Add the best torrent to Real-Debrid
-        result = add_torrent_and_select_files(best_torrent.infohash, best_torrent.data.parsed_title, "1", media_type)  # Pass media_type here
-        if result.get('success'):
-            # Mark the request as completed in Overseerr
-            mark_completed(request['media']['id'])
-        else:
-            logger.error("Failed to add torrent to Real-Debrid")
-    except Exception as e:
-        logger.error(f"Error processing Overseerr request: {e}")
+        best = top_candidates[0]
+        candidate = {
+            "info_hash": best.info_hash,
+            "file_idx": best.file_idx,
+            "title": best.title,
+            "rank": best.rank
+        }
+        _checkpoint(job, candidate=candidate)
+    logger.info(f"Best torrent selected: {candidate['title']} with rank {candidate['rank']}")
+    
+    # Add the best torrent to Real-Debrid
+    torrent_id = checkpoint.get('torrent_id')
+    if not torrent_id:
+        with job_stage(job, "add_torrent") as stage:
+            torrent_id = add_torrent_to_rd(candidate['info_hash'], candidate['title'])
+            if not torrent_id:
+                logger.error("Failed to add torrent to Real-Debrid")
+                _fail_stage(stage, "Failed to add torrent to Real-Debrid")
+                return PipelineResult(False, "Failed to add torrent to Real-Debrid", 500)
+        _checkpoint(job, torrent_id=torrent_id)
+    
+    # Select the wanted files of the torrent
+    if not checkpoint.get('files_selected'):
+        with job_stage(job, "select_files") as stage:
+            if not select_files_in_rd(torrent_id, candidate['file_idx'], media_type):
+                _fail_stage(stage, "Failed to select files in the torrent")
+                return PipelineResult(False, "Failed to select files in the torrent", 500)
+        _checkpoint(job, files_selected=True)
+    
+    # Mark the request as completed in Overseerr
+    if media_id is not None:
+        with job_stage(job, "mark_completed"):
+            mark_completed(media_id, is4k)
+    return PipelineResult(True, "Torrent added", info_hash=candidate['info_hash'], torrent_id=torrent_id)
+
+# Check RD availability for every stream, then rank the cached ones
+def select_rd_first(streams: list[dict], profile: str = STANDARD_PROFILE) -> list[RankedCandidate]:
+    availability = check_rd_availability_bulk(collect_info_hashes(streams))
+    available = [stream for stream in streams if availability.get((stream.get('infoHash') or '').lower())]
+    logger.info(f"{len(available)} of {len(streams)} streams are available on Real-Debrid.")
+    
+    # Rank the cached torrents in one batch and keep the top 5
+    return rank_streams(available, profile=profile)[:5]
+
+# Rank every stream locally, then check RD availability for the best ones only
+def select_rank_first(streams: list[dict], profile: str = STANDARD_PROFILE) -> list[RankedCandidate]:
+    ranked_candidates = rank_streams(streams, profile=profile)[:RANK_FIRST_TOP_N]
+    if not ranked_candidates:
+        return []
+    availability = check_rd_availability_bulk([candidate.info_hash for candidate in ranked_candidates])
+    return [candidate for candidate in ranked_candidates if availability.get(candidate.info_hash)]
+
+# Rank every stream locally, then check RD availability best first until one is cached
+def select_streaming(streams: list[dict], profile: str = STANDARD_PROFILE) -> list[RankedCandidate]:
+    base_url = RD_INSTANT_AVAILABILITY_URL.format(hash="").rstrip("/")
+    selection = StreamingSelection(*rank_table(streams, profile=profile), base_url)
+    while not selection.done:
+        rows = selection.next_batch()
+        selection.offer(rows, check_rd_availability_bulk([selection.table.info_hashes[row] for row in rows]))
+    return selection.result()
 
+def _fail_stage(stage, detail: str):
+    if stage is not None:
+        stage.status = "failed"
+        stage.detail = detail
 
-def mark_completed(media_id: int) -> bool:
-    """Mark item as completed in overseerr"""
+def mark_completed(media_id: int, is4k: bool = False) -> bool:
+    """Mark item (or its 4K version) as completed in overseerr"""
     url = f"{OVERSEERR_BASE}/api/v1/media/{media_id}/available"
     headers = {
         "X-Api-Key": OVERSEERR_API_KEY,
         "Content-Type": "application/json"
     }
-    data = {"is4k": False}
+    data = {"is4k": is4k}
     try:
         response = session.post(url, headers=headers, json=data)
         if response.status_code == 200:
@@ -181,28 +407,96 @@ def mark_completed(media_id: int) -> bool:
         logger.error(f"Failed to mark media as completed in overseerr with id {media_id}: {str(e)}")
         return False
 
-# Function to start processing the queue
-def start_processing_queue():
-    # Fetch media requests from Overseerr
-    overseerr_requests = get_overseerr_media_requests()
-    if not overseerr_requests:
-        logger.warning("No requests fetched from Overseerr.")
-    for request in overseerr_requests:
-        request_queue.put(request)
+# Function to feed Overseerr requests to the workers without waiting for them
+def sync_overseerr_requests() -> int:
+    # Start worker threads so they pick up requests while later pages download
+    start_workers()
+    
+    # Requests seen by an incremental sync are newly approved, a full walk is
+    # backlog reconciliation and runs every OVERSEERR_FULL_SYNC_HOURS
+    incremental = (OVERSEERR_INCREMENTAL_SYNC and get_state(OVERSEERR_WATERMARK) is not None
+                   and not _full_sync_due())
+    priority = PRIORITY_NORMAL if incremental else PRIORITY_LOW
+    if not incremental:
+        logger.info("Walking all approved Overseerr requests")
+    
+    # Stream media requests from Overseerr into the queue, skipping titles
+    # backed off after a negative result
+    count = 0
+    skipped = 0
+    for request in iter_overseerr_media_requests(incremental=incremental):
+        key = pipeline_key(request)
+        if backoff.backed_off(key):
+            skipped += 1
+            continue
+        if _enqueue_backlog(request, priority):
+            count += 1
+    if skipped:
+        logger.info(f"Skipped {skipped} requests backed off after a negative result")
     
-    # Start worker threads
-    num_threads = 5
-    for _ in range(num_threads):
-        threading.Thread(target=process_request_queue, daemon=True).start()
+    # Retry titles whose backoff expired, an incremental sync won't see them again
+    retries = sum(_enqueue_backlog(request, PRIORITY_LOW) for request in backoff.due_requests())
+    if retries:
+        logger.info(f"Retrying {retries} requests whose negative-result backoff expired")
+    
+    if not count and not retries:
+        logger.warning("No requests fetched from Overseerr.")
+    return count + retries
+
+# Check whether the last completed full walk of Overseerr requests is too old
+def _full_sync_due() -> bool:
+    last = get_state(OVERSEERR_LAST_FULL_SYNC)
+    return last is None or time.time() - float(last) >= OVERSEERR_FULL_SYNC_HOURS * 3600
+
+# Queue a backlog request unless it is already queued or in progress
+def _enqueue_backlog(request: dict, priority: int) -> bool:
+    key = pipeline_key(request)
+    with _backlog_lock:
+        if key in _backlog_keys:
+            return False
+        _backlog_keys.add(key)
+    enqueue_request(request, "backlog", priority=priority)
+    return True
+
+# Function to start processing the queue and wait until it is drained
+def start_processing_queue():
+    sync_overseerr_requests()
     
     # Wait for the queue to be processed
     request_queue.join()
 
-# Step 2: Search Trakt for the IMDb ID
+# Step 2: Resolve the IMDb ID, preferring the payload and the local cache over Trakt
+def resolve_imdb_id(tmdb_id: int, media_type: str, imdb_id: Optional[str] = None) -> Optional[str]:
+    """
+    Resolve the IMDb ID for a TMDb ID in three tiers: the ID carried by the
+    request payload, the persistent ID cache, then the Trakt API. Trakt
+    answers (including "not found") are written back to the cache.
+    """
+    if imdb_id:
+        return imdb_id
+
+    hit, imdb_id = get_cached_imdb_id(tmdb_id, media_type)
+    if hit:
+        logger.info(f"IMDb ID for tmdbId {tmdb_id} served from cache: {imdb_id}")
+        return imdb_id
+
+    definitive, imdb_id = lookup_imdb_id_on_trakt(tmdb_id, media_type)
+    if definitive:
+        store_imdb_id(tmdb_id, media_type, imdb_id)
+    return imdb_id
+
+# Step 2.5: Search Trakt for the IMDb ID
 def get_imdb_id_from_trakt(tmdb_id: int, media_type: str) -> Optional[str]:
     """
     Fetch the IMDb ID using the Trakt API based on the TMDb ID.
     """
+    return lookup_imdb_id_on_trakt(tmdb_id, media_type)[1]
+
+def lookup_imdb_id_on_trakt(tmdb_id: int, media_type: str) -> tuple[bool, Optional[str]]:
+    """
+    Search Trakt for the IMDb ID. Returns (definitive, imdb_id), where
+    definitive is False when the lookup failed and the answer is unknown.
+    """
     if media_type == "tv":
         url = f"https://api.trakt.tv/search/tmdb/{tmdb_id}?type=show"
     else:
@@ -220,40 +514,78 @@ def get_imdb_id_from_trakt(tmdb_id: int, media_type: str) -> Optional[str]:
             
             if response.status_code == 200:
                 data = response.json()
-                if data and isinstance(data, list) and data:
+                if data and isinstance(data, list):
                     # Corrected logic to extract IMDb ID
                     if media_type == "tv":
-                        return data[0]['show']['ids']['imdb']
+                        return True, data[0]['show']['ids']['imdb']
                     else:
-                        return data[0]['movie']['ids']['imdb']
+                        return True, data[0]['movie']['ids']['imdb']
                 else:
                     logger.error("IMDb ID not found in Trakt API response.")
-                    return None
+                    return True, None
             else:
                 logger.error(f"Trakt API request failed with status code {response.status_code}")
-                return None
+                return False, None
         except requests.exceptions.RequestException as e:
             logger.error(f"Error fetching IMDb ID from Trakt API (attempt {attempt + 1}): {e}")
             if attempt == 4:  # Last attempt
-                return None
-
-
+                return False, None
 
 
 # Step 3: Query Torrentio API to get available torrents
-@sleep_and_retry
-@limits(calls=MAX_CALLS_PER_MINUTE, period=60)
-def query_torrentio(imdb_id: str, media_type: str) -> Optional[Dict[str, Any]]:
+def torrentio_request(imdb_id: str, media_type: str, season: int = 1, episode: int = 1) -> tuple[tuple, str]:
+    """
+    Build the cache key and URL of a Torrentio stream listing. The key covers
+    everything that changes the response: IMDb ID, media type, season,
+    episode and the filter options.
+    """
     if media_type == "tv":
-        url = f"https://torrentio.strem.fun/qualityfilter=scr,cam/stream/series/{imdb_id}:1:1.json"
+        key = (imdb_id, media_type, season, episode, TORRENTIO_OPTIONS)
+        url = TORRENTIO_API_URL.format(options=TORRENTIO_OPTIONS, kind="series", stream_id=f"{imdb_id}:{season}:{episode}")
     else:
-        url = f"https://torrentio.strem.fun/qualityfilter=scr,cam/stream/movie/{imdb_id}.json"
+        key = (imdb_id, media_type, None, None, TORRENTIO_OPTIONS)
+        url = TORRENTIO_API_URL.format(options=TORRENTIO_OPTIONS, kind="movie", stream_id=imdb_id)
+    return key, url
+
+def query_torrentio(imdb_id: str, media_type: str, season: int = 1, episode: int = 1) -> Optional[Dict[str, Any]]:
+    """
+    Return the Torrentio stream listing, served from the response cache while
+    fresh. Stale entries are returned immediately and revalidated in a
+    background thread.
+    """
+    key, url = torrentio_request(imdb_id, media_type, season, episode)
+    entry, needs_refresh = torrentio_cache.lookup(key)
+    if entry is not None:
+        if needs_refresh and torrentio_cache.claim_refresh(key):
+            threading.Thread(target=_revalidate_torrentio, args=(key, url), daemon=True).start()
+        logger.info(f"Torrentio results for {imdb_id} served from cache (age {entry.age:.0f}s)")
+        return entry.data
+    return upstream_flight.do(("torrentio", url), fetch_torrentio, key, url)[0]
+
+def _revalidate_torrentio(key: tuple, url: str):
+    try:
+        upstream_flight.do(("torrentio", url), fetch_torrentio, key, url)
+    finally:
+        torrentio_cache.release_refresh(key)
+
+def fetch_torrentio(key: tuple, url: str) -> Optional[Dict[str, Any]]:
+    """
+    Fetch a Torrentio listing and store it in the cache, revalidating with
+    ETag/Last-Modified when a previous response is known.
+    """
+    previous = torrentio_cache.get(key)
+    headers = previous.validators() if previous else {}
     
     for attempt in range(5):  # Retry up to 5 times
         try:
-            response = session.get(url, timeout=10)  # Add timeout here
-            if response.status_code == 200:
-                return response.json()
+            response = session.get(url, headers=headers, timeout=10)  # Add timeout here
+            if response.status_code == 304 and previous:
+                torrentio_cache.touch(key, previous)
+                return previous.data
+            elif response.status_code == 200:
+                data = response.json()
+                torrentio_cache.store(key, data, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+                return data
             else:
                 logger.error(f"Torrentio API failed with status code {response.status_code}")
                 return None
@@ -280,8 +612,18 @@ def get_instant_availability(hashes: list[str]) -> dict[str, dict[int, dict[str,
             "10CE69DFFB064E887E8833E7754F71AA7532C997": {}, # Non-cached
         }
     """
+    results = fetch_instant_availability(hashes)
+    if results is None:
+        return {hash: {} for hash in hashes}
+    return results
+
+def fetch_instant_availability(hashes: list[str]) -> Optional[dict[str, dict[int, dict[str, int]]]]:
+    """
+    Query instantAvailability for hash(es). Returns None when the request
+    failed, so callers can tell "not cached" from "unknown".
+    """
     hashes_str = "/".join(hashes)
-    url = f"{REAL_DEBRID_API_BASE_URL}/torrents/instantAvailability/{hashes_str}"
+    url = RD_INSTANT_AVAILABILITY_URL.format(hash=hashes_str)
     headers = {
         'Authorization': f'Bearer {RD_API_KEY}'
     }
@@ -289,49 +631,63 @@ def get_instant_availability(hashes: list[str]) -> dict[str, dict[int, dict[str,
     
     if response.status_code != 200:
         logger.error(f"Real-Debrid instant availability failed with status code {response.status_code}")
-        return {hash: {} for hash in hashes}
+        return None
 
     data = response.json()
     
     # Ensure the response is a dictionary and not a list
     if isinstance(data, list):
         logger.error("Unexpected response format: received a list instead of a dictionary.")
-        return {hash: {} for hash in hashes}
+        return None
     
     results = {}
     for hash, values in data.items():
-        if "rd" in values and values["rd"]:
+        if isinstance(values, dict) and "rd" in values and values["rd"]:
             result = {int(k): {"filename": v["filename"], "filesize": v["filesize"]} 
                       for container in values["rd"] for k, v in container.items()}
-            results[hash] = result
+            results[hash.lower()] = result
         else:
-            results[hash] = {}
+            results[hash.lower()] = {}
     return results
 
 # Step 4.5: Check torrent availability on Real-Debrid
-@sleep_and_retry
-@limits(calls=MAX_CALLS_PER_MINUTE, period=60)
 def check_rd_availability(info_hash: str) -> Optional[Dict[str, Any]]:
     """
     Check the instant availability of a torrent hash on Real-Debrid.
     """
-    availability = get_instant_availability([info_hash])
-    if isinstance(availability, dict) and info_hash in availability:
-        if availability[info_hash]:
-            logger.info(f"Torrent with hash {info_hash} is available on Real-Debrid.")
-            return availability[info_hash]
-        else:
-            logger.info(f"Torrent with hash {info_hash} is not available on Real-Debrid.")
-            return None
-    else:
-        logger.error(f"Unexpected response format from Real-Debrid for hash {info_hash}")
-        return None
+    info_hash = info_hash.lower()
+    files = check_rd_availability_bulk([info_hash])[info_hash]
+    if files:
+        logger.info(f"Torrent with hash {info_hash} is available on Real-Debrid.")
+        return files
+    logger.info(f"Torrent with hash {info_hash} is not available on Real-Debrid.")
+    return None
+
+# Step 4.6: Check the availability of many hashes in as few requests as possible
+def check_rd_availability_bulk(info_hashes: list[str]) -> dict[str, dict[int, dict[str, int]]]:
+    """
+    Resolve the instant availability of many hashes. Hashes found in the shared
+    availability cache are not sent to RD; the rest are batched into
+    URL-length-bounded instantAvailability calls. Keys are lowercase hashes,
+    non-cached hashes map to an empty dict.
+    """
+    results, misses = rd_availability_cache.get_many([info_hash.lower() for info_hash in info_hashes])
+    num_hits = len(results)
+    num_requests = 0
+    base_url = RD_INSTANT_AVAILABILITY_URL.format(hash="").rstrip("/")
+    for chunk in chunk_hashes(misses, base_url):
+        availability, _ = upstream_flight.do(("rd_availability", tuple(chunk)), fetch_instant_availability, chunk)
+        num_requests += 1
+        chunk_results = {info_hash: (availability or {}).get(info_hash) or {} for info_hash in chunk}
+        if availability is not None:
+            rd_availability_cache.put_many(chunk_results)
+        results.update(chunk_results)
+    cached = sum(1 for files in results.values() if files)
+    logger.info(f"{cached}/{len(results)} torrents available on Real-Debrid ({num_hits} from cache, {num_requests} requests)")
+    return results
 
 # Step 5: Add torrent to Real-Debrid and select specific files
 # Step 5: Add torrent to Real-Debrid and select specific files
-# Step 5: Add torrent to Real-Debrid and select specific files
-@sleep_and_retry
-@limits(calls=MAX_CALLS_PER_MINUTE, period=60)
 def add_torrent_and_select_files(info_hash: str, torrent_name: str, file_idx: int, media_type: str) -> Optional[Dict[str, Any]]:
     """
     Add a torrent to Real-Debrid and select specific files.
@@ -342,6 +698,25 @@ def add_torrent_and_select_files(info_hash: str, torrent_name: str, file_idx: in
     :param media_type: The type of media (movie or tv).
     :return: The response from the Real-Debrid API if successful, None otherwise.
     """
+    torrent_id = add_torrent_to_rd(info_hash, torrent_name)
+    if torrent_id is None:
+        return None
+    
+    # Step 6: Select specific files in the torrent
+    if select_files_in_rd(torrent_id, file_idx, media_type):
+        return {"success": True, "message": f"Torrent added and files selected.", "torrent_id": torrent_id}
+    else:
+        return {"success": False, "message": "Failed to select files in the torrent."}
+
+# Step 5.5: Add a magnet to Real-Debrid without selecting files
+def add_torrent_to_rd(info_hash: str, torrent_name: str) -> Optional[str]:
+    """
+    Add a torrent to Real-Debrid by magnet link.
+    
+    :param info_hash: The info hash of the torrent.
+    :param torrent_name: The name of the torrent.
+    :return: The Real-Debrid torrent ID if the torrent was added, None otherwise.
+    """
     url = RD_ADD_TORRENT_URL
     headers = {
         'Authorization': f'Bearer {RD_API_KEY}'
@@ -351,32 +726,22 @@ def add_torrent_and_select_files(info_hash: str, torrent_name: str, file_idx: in
     }
     response = session.post(url, headers=headers, data=data)
     
-    if response.status_code == 201:
-        rd_response = response.json()
-        torrent_id = rd_response.get('id')
-        
-        if torrent_id:
-            logger.info(f"Torrent added to Real-Debrid successfully: {info_hash}")
-            
-            # Step 6: Select specific files in the torrent
-            if select_files_in_rd(torrent_id, file_idx, media_type):
-                return {"success": True, "message": f"Torrent added and files selected.", "torrent_id": torrent_id}
-            else:
-                return {"success": False, "message": "Failed to select files in the torrent."}
-        else:
-            logger.error("Torrent ID not found in Real-Debrid response.")
-            return {"success": False, "message": "Torrent added, but torrent ID not found."}
-    else:
+    if response.status_code != 201:
         logger.error(f"Failed to add torrent to Real-Debrid with status code {response.status_code}")
         return None
+    
+    torrent_id = response.json().get('id')
+    if not torrent_id:
+        logger.error("Torrent ID not found in Real-Debrid response.")
+        return None
+    logger.info(f"Torrent added to Real-Debrid successfully: {info_hash}")
+    return torrent_id
 
 
 
 
 # Step 6: Select specific files from the torrent in Real-Debrid
 # Step 6: Select specific files from the torrent in Real-Debrid
-@sleep_and_retry
-@limits(calls=MAX_CALLS_PER_MINUTE, period=60)
 def select_files_in_rd(torrent_id: str, file_idx: int, media_type: str) -> bool:
     """
     Select specific files in a Real-Debrid torrent using the torrent ID.